@@ -15,6 +15,8 @@ from lib.pimport import PluginImport
 from lib.logging import CustomFormatter
 from lib.main import MainLoop
 from lib.config import OperatingMode
+from lib.exec_step import write_stats
+from lib.connect import connections
 
 
 LOAD_DATA = 0x0000
@@ -87,17 +89,39 @@ class Params(object):
         schema_parser.add_argument('--help', action='help', default=argparse.SUPPRESS, help='Show help message')
         run_parser = argparse.ArgumentParser(add_help=False)
         run_parser.add_argument('--count', action='store', help="Record Count", type=int_arg)
-        run_parser.add_argument('--ops', action='store', help="Operation Count", type=int_arg)
+        run_parser.add_argument('--generators', action='store', help="Document generator processes", type=int_arg)
+        run_parser.add_argument('--imagepool', action='store', help="Pre-rendered image pool size", type=int_arg)
+        run_parser.add_argument('--imagesize', action='store', help="Pool image dimensions (WIDTHxHEIGHT)")
+        run_parser.add_argument('--imageformat', action='store', help="Pool image format")
+        run_parser.add_argument('--imagecache', action='store', help="Image pool cache directory")
+        run_parser.add_argument('--compress', action='store_true', help="Compress generated data files")
+        run_parser.add_argument('--replay', action='store', help="Load generated data files from directory")
+        run_parser.add_argument('--barrier', action='store_true', help="Wait for each write batch to complete")
+        run_parser.add_argument('--writebatch', action='store', help="Documents per batched write", type=int_arg)
+        run_parser.add_argument('--processes', action='store', help="Load processes", type=int_arg)
+        run_parser.add_argument('--parallel', action='store', help="Collections to load at once", type=int_arg)
+        run_parser.add_argument('--connections', action='store', help="Cluster connections per load", type=int_arg)
+        run_parser.add_argument('--ops', action='store', help="Target operations per second", type=int_arg)
         run_parser.add_argument('--threads', action='store', help="Threads for run", type=int_arg)
         run_parser.add_argument('--replica', action='store', help="Replica Count", type=int_arg, default=1)
         run_parser.add_argument('--quota', action='store', help="Bucket Memory Quota", type=int_arg)
         run_parser.add_argument('--output', action='store', help="Output file for run stats")
+        run_parser.add_argument('--interval', action='store', help="Report interval stats every N seconds", type=int_arg)
+        run_parser.add_argument('--series', action='store', help="Append interval stats to CSV or JSON file")
         run_parser.add_argument('--inventory', action='store', help="Location of inventory JSON")
         run_parser.add_argument('--id', action='store', help="ID field for file based collection schema", default="record_id")
         run_parser.add_argument('--max', action='store', help="Max ramp threads", type=int_arg)
+        run_parser.add_argument('--mix', action='store', help="KV operation mix (read=N,update=N,insert=N,delete=N)")
+        run_parser.add_argument('--keydist', action='store', help="KV key distribution")
+        run_parser.add_argument('--duration', action='store', help="Test duration in seconds", type=int_arg)
+        run_parser.add_argument('--opcount', action='store', help="Test operation count", type=int_arg)
         run_parser.add_argument('--ramp', action='store_true', help="Run Calibration Style Test")
+        run_parser.add_argument('--steptime', action='store', help="Seconds per ramp step", type=int_arg)
+        run_parser.add_argument('--latency', action='store', help="Ramp p99 latency limit in ms", type=int_arg)
         run_parser.add_argument('--sync', action='store_true', help="Use Synchronous Connections")
         run_parser.add_argument('--noinit', action='store_true', help="Skip init phase")
+        run_parser.add_argument('--defer', action='store_true', help="Build indexes after data load")
+        run_parser.add_argument('--checkpoint', action='store', help="Record load progress in this file")
         run_parser.add_argument('--skipbucket', action='store_true', help="Use Preexisting bucket")
         run_parser.add_argument('--skiprules', action='store_true', help="Do not run rules if defined")
         subparsers = parser.add_subparsers(dest='command')
@@ -110,6 +134,9 @@ class Params(object):
         export_action = export_mode.add_subparsers(dest='export_command')
         export_action.add_parser('csv', help="Export CSV", parents=[parent_parser, run_parser], add_help=False)
         export_action.add_parser('json', help="Export JSON", parents=[parent_parser, run_parser], add_help=False)
+        kv_mode = subparsers.add_parser('kv', help="KV Workload Test", parents=[parent_parser, run_parser], add_help=False)
+        query_mode = subparsers.add_parser('query', help="Query Workload Test", parents=[parent_parser, run_parser], add_help=False)
+        generate_mode = subparsers.add_parser('generate', help="Generate Data Files", parents=[parent_parser, run_parser], add_help=False)
         import_mode = subparsers.add_parser('import', help="Import Data", parents=[parent_parser, run_parser], add_help=False)
         self.parser = parser
         self.list_parser = list_mode
@@ -119,6 +146,9 @@ class Params(object):
         self.schema_parser = schema_mode
         self.export_parser = export_mode
         self.import_parser = import_mode
+        self.generate_parser = generate_mode
+        self.kv_parser = kv_mode
+        self.query_parser = query_mode
 
 
 class CBPerf(object):
@@ -147,8 +177,29 @@ class CBPerf(object):
         elif self.verb == 'import':
             PluginImport().import_tables()
             sys.exit(0)
+        elif self.verb == 'kv':
+            if not config.schema:
+                raise ParameterError("kv requires a schema")
+            MainLoop().kv_run()
+            sys.exit(0)
+        elif self.verb == 'query':
+            if not config.schema:
+                raise ParameterError("query requires a schema")
+            MainLoop().query_run()
+            sys.exit(0)
+        elif self.verb == 'generate':
+            if not config.schema:
+                raise ParameterError("generate requires a schema")
+            MainLoop().schema_generate()
+            sys.exit(0)
         else:
-            if config.op_mode == OperatingMode.LOAD.value and self.args.schema:
+            if config.op_mode == OperatingMode.LOAD.value and config.ramp_mode:
+                if not config.schema:
+                    raise ParameterError("calibration requires a schema")
+                MainLoop().calibrate()
+            elif config.op_mode == OperatingMode.LOAD.value and config.replay_dir:
+                MainLoop().replay_load()
+            elif config.op_mode == OperatingMode.LOAD.value and self.args.schema:
                 MainLoop().schema_load()
             elif config.op_mode == OperatingMode.LOAD.value:
                 MainLoop().input_load()
@@ -195,7 +246,12 @@ def main():
 
     config.process_params(parameters)
     test_run = CBPerf(parameters)
-    test_run.run()
+    try:
+        test_run.run()
+    finally:
+        connections.close()
+        if config.stats_file:
+            write_stats(config.stats_file, parameters.command)
 
 
 if __name__ == '__main__':
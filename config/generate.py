@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import argparse
 import json
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from lib.datastore import write_store
+
 
 class Params(object):
 
@@ -17,6 +23,7 @@ class Params(object):
         parser.add_argument('--area', action='store', help="Area Codes")
         parser.add_argument('--franchise', action='store', help="Franchise Names")
         parser.add_argument('--corporation', action='store', help="Company Names")
+        parser.add_argument('--json', action='store', help="Convert an existing data.json file")
         self.args = parser.parse_args()
 
     @property
@@ -24,90 +31,36 @@ class Params(object):
         return self.args
 
 
-p = Params()
-options = p.parameters
-male_names = []
-female_names = []
-last_names = []
-street_names = []
-city_names = []
-card_masks = []
-area_codes = []
-franchises = []
-corporations = []
-
-
-with open(options.male, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        male_names.append(item)
-
-with open(options.female, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        female_names.append(item)
+def read_list(filename):
+    items = []
+    with open(filename, 'r') as dat_file:
+        while True:
+            line = dat_file.readline()
+            if not line:
+                break
+            item = line.strip()
+            items.append(item)
+    return items
 
-with open(options.last, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        last_names.append(item)
 
-with open(options.street, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        street_names.append(item)
-
-with open(options.city, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        city_names.append(item)
-
-with open(options.cards, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        card_masks.append(item)
-
-with open(options.area, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        area_codes.append(item)
-
-with open(options.franchise, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        franchises.append(item)
+p = Params()
+options = p.parameters
 
-with open(options.corporation, 'r') as dat_file:
-    while True:
-        line = dat_file.readline()
-        if not line:
-            break
-        item = line.strip()
-        corporations.append(item)
+if options.json:
+    with open(options.json, 'r') as json_file:
+        data_struct = json.load(json_file)
+    write_store('data.bin', data_struct)
+    sys.exit(0)
+
+male_names = read_list(options.male)
+female_names = read_list(options.female)
+last_names = read_list(options.last)
+street_names = read_list(options.street)
+city_names = read_list(options.city)
+card_masks = read_list(options.cards)
+area_codes = read_list(options.area)
+franchises = read_list(options.franchise)
+corporations = read_list(options.corporation)
 
 data_struct = {
     "first_names": {
@@ -265,3 +218,5 @@ data_struct = {
 
 with open('data.json', 'w') as data_file:
     json.dump(data_struct, data_file)
+
+write_store('data.bin', data_struct)
@@ -0,0 +1,93 @@
+##
+##
+
+import logging
+import fcntl
+import json
+import os
+import threading
+import time
+from lib.exceptions import CheckpointError
+
+file_lock = threading.Lock()
+
+
+class Checkpoint(object):
+
+    def __init__(self, filename: str, name: str, resume: bool = False, interval: float = 5.0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.filename = filename
+        self.name = name
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.mark = self.read(filename).get(name, 0) if resume else 0
+        self.start = self.mark
+        self.current = self.mark + 1
+        self.completed = {}
+        self.save_time = time.perf_counter()
+        if not resume:
+            self.save()
+
+    @staticmethod
+    def read(filename: str) -> dict:
+        if not filename:
+            return {}
+        try:
+            with open(filename, 'r') as checkpoint_file:
+                return json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            raise CheckpointError(f"can not read checkpoint file {filename}: {err}")
+
+    def track(self, blocks):
+        for n, documents in blocks:
+            self.current = n
+            yield n, documents
+
+    def complete(self, first: int, count: int):
+        with self.lock:
+            self.completed[first] = count
+            while self.mark + 1 in self.completed:
+                self.mark += self.completed.pop(self.mark + 1)
+            if time.perf_counter() - self.save_time > self.interval:
+                self.save()
+
+    def task_done(self, first: int, count: int, task):
+        if task.cancelled() or task.exception():
+            return
+        result, latency = task.result()
+        if all(result.values()):
+            self.complete(first, count)
+
+    def save(self):
+        self.save_time = time.perf_counter()
+        if not self.filename:
+            return
+        temp_file = f"{self.filename}.{os.getpid()}.tmp"
+        try:
+            with file_lock, open(f"{self.filename}.lock", 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                data = self.read(self.filename)
+                data[self.name] = self.mark
+                with open(temp_file, 'w') as checkpoint_file:
+                    json.dump(data, checkpoint_file, indent=2)
+                os.replace(temp_file, self.filename)
+        except OSError as err:
+            self.logger.error(f"can not write checkpoint file {self.filename}: {err}")
+
+
+class RangeCheckpoint(Checkpoint):
+
+    def __init__(self, start: int, output, interval: float = 1.0):
+        self.output = output
+        self.sent = start - 1
+        super().__init__(None, f"range.{start}", interval=interval)
+        self.mark = self.start = start - 1
+        self.current = start
+
+    def save(self):
+        self.save_time = time.perf_counter()
+        if self.mark > self.sent:
+            self.output.put(("complete", self.sent + 1, self.mark - self.sent))
+            self.sent = self.mark
@@ -7,6 +7,7 @@ import warnings
 import argparse
 from enum import Enum
 from lib.schema import ProcessSchema, ProcessVariables
+from lib.exceptions import ParameterError
 
 
 warnings.filterwarnings("ignore")
@@ -68,6 +69,36 @@ command = "load"
 op_mode = OperatingMode.LOAD.value
 continuous = False
 batch_size = 100
+write_batch = 10
+load_processes = 0
+ops_rate = 0
+ramp_mode = False
+run_threads = 0
+max_threads = 256
+ramp_step_time = 30
+latency_limit = 0
+kv_mix = "read=50,update=50"
+key_distribution = "uniform"
+run_duration = 0
+operation_count = 0
+stats_file = None
+interval_seconds = 0
+series_file = None
+skip_init = False
+checkpoint_file = None
+load_parallel = 1
+connection_count = 1
+defer_index = False
+generator_processes = 0
+image_pool_size = 64
+image_width = 128
+image_height = 128
+image_format = "JPEG2000"
+image_cache_dir = None
+compress_output = False
+replay_dir = None
+barrier_mode = False
+sync_mode = False
 count = 100
 replicas = 0
 bucket_quota = 256
@@ -90,6 +121,14 @@ plugin_name = None
 plugin_vars = {}
 
 
+def settings() -> dict:
+    return {k: v for k, v in globals().items() if not k.startswith('_') and isinstance(v, (str, int, float, bool, list, dict, type(None)))}
+
+
+def apply_settings(values: dict) -> None:
+    globals().update(values)
+
+
 def process_params(parameters: argparse.Namespace) -> None:
     logger = logging.getLogger(__name__)
     global username, \
@@ -124,7 +163,37 @@ def process_params(parameters: argparse.Namespace) -> None:
         screen_output, \
         key_field, \
         plugin_name, \
-        plugin_vars
+        plugin_vars, \
+        generator_processes, \
+        image_pool_size, \
+        image_width, \
+        image_height, \
+        image_format, \
+        image_cache_dir, \
+        compress_output, \
+        replay_dir, \
+        barrier_mode, \
+        sync_mode, \
+        write_batch, \
+        load_processes, \
+        ops_rate, \
+        ramp_mode, \
+        run_threads, \
+        max_threads, \
+        ramp_step_time, \
+        latency_limit, \
+        kv_mix, \
+        key_distribution, \
+        run_duration, \
+        operation_count, \
+        stats_file, \
+        interval_seconds, \
+        series_file, \
+        skip_init, \
+        checkpoint_file, \
+        load_parallel, \
+        connection_count, \
+        defer_index
 
     if parameters.user:
         username = parameters.user
@@ -195,6 +264,67 @@ def process_params(parameters: argparse.Namespace) -> None:
         op_mode = OperatingMode.LIST.value
     if parameters.count:
         count = parameters.count
+    if parameters.generators:
+        generator_processes = parameters.generators
+    if parameters.imagepool:
+        image_pool_size = parameters.imagepool
+    if parameters.imagesize:
+        try:
+            image_width, image_height = [int(n) for n in parameters.imagesize.lower().split('x')]
+        except ValueError:
+            raise ParameterError(f"image size should be in the form WIDTHxHEIGHT: {parameters.imagesize}")
+    if parameters.imageformat:
+        image_format = parameters.imageformat.upper()
+    if parameters.imagecache:
+        image_cache_dir = parameters.imagecache
+    if parameters.compress:
+        compress_output = parameters.compress
+    if parameters.replay:
+        replay_dir = parameters.replay
+    if parameters.barrier:
+        barrier_mode = parameters.barrier
+    if parameters.sync:
+        sync_mode = parameters.sync
+    if parameters.writebatch:
+        write_batch = parameters.writebatch
+    if parameters.processes:
+        load_processes = parameters.processes
+    if parameters.ops:
+        ops_rate = parameters.ops
+    if parameters.ramp:
+        ramp_mode = parameters.ramp
+    if parameters.threads:
+        run_threads = parameters.threads
+    if parameters.max:
+        max_threads = parameters.max
+    if parameters.steptime:
+        ramp_step_time = parameters.steptime
+    if parameters.latency:
+        latency_limit = parameters.latency
+    if parameters.mix:
+        kv_mix = parameters.mix
+    if parameters.keydist:
+        key_distribution = parameters.keydist
+    if parameters.duration:
+        run_duration = parameters.duration
+    if parameters.opcount:
+        operation_count = parameters.opcount
+    if parameters.output:
+        stats_file = parameters.output
+    if parameters.interval:
+        interval_seconds = parameters.interval
+    if parameters.series:
+        series_file = parameters.series
+    if parameters.parallel:
+        load_parallel = parameters.parallel
+    if parameters.connections:
+        connection_count = parameters.connections
+    if parameters.defer:
+        defer_index = parameters.defer
+    if parameters.noinit:
+        skip_init = parameters.noinit
+    if parameters.checkpoint:
+        checkpoint_file = parameters.checkpoint
 
     if op_mode == OperatingMode.LIST.value:
         if parameters.wait:
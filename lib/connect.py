@@ -0,0 +1,298 @@
+##
+##
+
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from typing import Union
+from acouchbase.cluster import Cluster
+from couchbase.options import WaitUntilReadyOptions, QueryOptions
+from couchbase.diagnostics import ServiceType
+from couchbase.exceptions import (DocumentNotFoundException, DocumentExistsException, QueryIndexAlreadyExistsException, AmbiguousTimeoutException,
+                                  UnAmbiguousTimeoutException, TimeoutException, TemporaryFailException, DocumentLockedException)
+from couchbase.management.options import (CreateQueryIndexOptions, CreatePrimaryQueryIndexOptions, BuildDeferredQueryIndexOptions,
+                                          WatchQueryIndexOptions)
+from cbcmgr.cb_connect import CBConnect, JSONType
+from cbcmgr.cb_management import CBManager
+from cbcmgr.retry import retry
+import lib.config as config
+
+RETRY_COUNT = 10
+RETRY_FACTOR = 0.01
+RETRY_ERRORS = (AmbiguousTimeoutException, UnAmbiguousTimeoutException, TimeoutException, TemporaryFailException, DocumentLockedException)
+
+
+def retry_wait(retry_number: int) -> float:
+    return RETRY_FACTOR * 2 ** (retry_number + 1)
+
+
+def multi_status(name: str, logger, documents: dict, errors: dict) -> dict:
+    status = {}
+    for key in documents:
+        err = errors.get(key, False)
+        if isinstance(err, DocumentExistsException):
+            status[key] = None
+        else:
+            if err is not False:
+                logger.debug(f"{name}: {key}: {type(err).__name__}: {err}")
+            status[key] = err is False
+    return status
+
+
+class CBConnectBatch(CBConnect):
+
+    def retry_multi(self, operation, documents: dict) -> dict:
+        errors = {}
+        pending = documents
+        for retry_number in range(RETRY_COUNT + 1):
+            result = operation(pending)
+            for key in pending:
+                if key in result.results:
+                    errors.pop(key, None)
+                else:
+                    errors[key] = result.exceptions.get(key)
+            pending = {key: pending[key] for key, err in result.exceptions.items() if isinstance(err, RETRY_ERRORS)}
+            if not pending:
+                break
+            if retry_number < RETRY_COUNT:
+                self.logger.debug(f"retrying {len(pending)} keys, number {retry_number + 1}")
+                time.sleep(retry_wait(retry_number))
+        return errors
+
+    def cb_upsert_multi(self, documents: dict) -> dict:
+        return multi_status("cb_upsert_multi", self.logger, documents, self.retry_multi(self._collection.upsert_multi, documents))
+
+    def cb_insert_multi(self, documents: dict) -> dict:
+        return multi_status("cb_insert_multi", self.logger, documents, self.retry_multi(self._collection.insert_multi, documents))
+
+    @retry(allow_list=RETRY_ERRORS)
+    def cb_insert(self, key: Union[int, str], document: JSONType):
+        try:
+            document_id = self.construct_key(key)
+            return self._collection.insert(document_id, document)
+        except DocumentExistsException:
+            return None
+
+    def cb_remove(self, key: Union[int, str]):
+        try:
+            document_id = self.construct_key(key)
+            return self._collection.remove(document_id)
+        except DocumentNotFoundException:
+            return None
+
+    def cb_query_rows(self, statement: str, parameters: dict) -> int:
+        result = self._cluster.query(statement, QueryOptions(named_parameters=parameters, adhoc=False, metrics=False))
+        return sum(1 for _ in result)
+
+
+class CBIndexManager(CBManager):
+
+    def keyspace_options(self) -> dict:
+        if self._collection.name != '_default':
+            return {"collection_name": self._collection.name, "scope_name": self._scope.name}
+        return {}
+
+    @retry()
+    def cb_create_primary_index(self, replica: int = 0, timeout: int = 480, deferred: bool = False):
+        index_options = CreatePrimaryQueryIndexOptions(deferred=deferred, timeout=timedelta(seconds=timeout), num_replicas=replica, **self.keyspace_options())
+        try:
+            self._cluster.query_indexes().create_primary_index(self._bucket.name, index_options)
+        except QueryIndexAlreadyExistsException:
+            pass
+
+    @retry()
+    def cb_create_index(self, fields: list[str], replica: int = 0, timeout: int = 480, deferred: bool = False):
+        index_options = CreateQueryIndexOptions(deferred=deferred, timeout=timedelta(seconds=timeout), num_replicas=replica, **self.keyspace_options())
+        try:
+            index_name = self.index_name(fields)
+            self._cluster.query_indexes().create_index(self._bucket.name, index_name, fields, index_options)
+            return index_name
+        except QueryIndexAlreadyExistsException:
+            return None
+
+    @retry()
+    def cb_build_deferred_indexes(self, timeout: int = 480):
+        index_options = BuildDeferredQueryIndexOptions(timeout=timedelta(seconds=timeout), **self.keyspace_options())
+        self._cluster.query_indexes().build_deferred_indexes(self._bucket.name, index_options)
+
+    def cb_watch_indexes(self, names: list[str], primary: bool = False, timeout: int = 480):
+        index_options = WatchQueryIndexOptions(timeout=timedelta(seconds=timeout), watch_primary=primary, **self.keyspace_options())
+        self._cluster.query_indexes().watch_indexes(self._bucket.name, names, index_options)
+
+
+class CBConnectAsync(CBConnectBatch):
+
+    async def connect(self, bucket: str = None, scope: str = "_default", collection: str = "_default"):
+        self.logger.debug(f"connect: async connect string {self.cb_connect_string}")
+        self._cluster = await Cluster.connect(self.cb_connect_string, self.cluster_options)
+        await self._cluster.wait_until_ready(timedelta(seconds=4), WaitUntilReadyOptions(service_types=[ServiceType.KeyValue, ServiceType.Management]))
+        if bucket:
+            self._bucket = await self.open_bucket(bucket)
+            self.select(scope, collection)
+        return self
+
+    async def open_bucket(self, name: str):
+        bucket = self._cluster.bucket(name)
+        await bucket.on_connect()
+        return bucket
+
+    def select(self, scope: str = "_default", collection: str = "_default"):
+        self._scope = self._bucket.scope(scope)
+        self._scope_name = scope
+        self._collection = self._scope.collection(collection)
+        self._collection_name = collection
+        return self
+
+    async def close(self):
+        if self._cluster:
+            await self._cluster.close()
+
+    async def cb_get(self, key: Union[int, str]):
+        try:
+            document_id = self.construct_key(key)
+            result = await self._collection.get(document_id)
+            return result.content_as[dict]
+        except DocumentNotFoundException:
+            return None
+
+    async def cb_upsert(self, key: Union[int, str], document: JSONType):
+        try:
+            document_id = self.construct_key(key)
+            return await self._collection.upsert(document_id, document)
+        except DocumentExistsException:
+            return None
+
+    @retry(allow_list=RETRY_ERRORS)
+    async def cb_insert(self, key: Union[int, str], document: JSONType):
+        try:
+            document_id = self.construct_key(key)
+            return await self._collection.insert(document_id, document)
+        except DocumentExistsException:
+            return None
+
+    async def cb_remove(self, key: Union[int, str]):
+        try:
+            document_id = self.construct_key(key)
+            return await self._collection.remove(document_id)
+        except DocumentNotFoundException:
+            return None
+
+    async def cb_query_rows(self, statement: str, parameters: dict) -> int:
+        result = self._cluster.query(statement, QueryOptions(named_parameters=parameters, adhoc=False, metrics=False))
+        rows = 0
+        async for _ in result:
+            rows += 1
+        return rows
+
+    async def retry_multi(self, operation, documents: dict) -> dict:
+        errors = {}
+        pending = list(documents)
+        for retry_number in range(RETRY_COUNT + 1):
+            results = await asyncio.gather(*[operation(key, documents[key]) for key in pending], return_exceptions=True)
+            for key, result in zip(pending, results):
+                if isinstance(result, Exception):
+                    errors[key] = result
+                else:
+                    errors.pop(key, None)
+            pending = [key for key, result in zip(pending, results) if isinstance(result, RETRY_ERRORS)]
+            if not pending:
+                break
+            if retry_number < RETRY_COUNT:
+                self.logger.debug(f"retrying {len(pending)} keys, number {retry_number + 1}")
+                await asyncio.sleep(retry_wait(retry_number))
+        return errors
+
+    async def cb_upsert_multi(self, documents: dict) -> dict:
+        return multi_status("cb_upsert_multi", self.logger, documents, await self.retry_multi(self._collection.upsert, documents))
+
+    async def cb_insert_multi(self, documents: dict) -> dict:
+        return multi_status("cb_insert_multi", self.logger, documents, await self.retry_multi(self._collection.insert, documents))
+
+
+class ConnectionRegistry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.clusters = {}
+        self.buckets = {}
+        self.async_clusters = {}
+
+    @staticmethod
+    def key() -> tuple:
+        return config.host, config.username, config.password, config.tls
+
+    @staticmethod
+    def handle(connect_class, source, cluster=None):
+        handle = connect_class.__new__(connect_class)
+        handle.__dict__.update(source.__dict__)
+        handle._cluster = cluster
+        handle._bucket = None
+        handle._scope = None
+        handle._collection = None
+        return handle
+
+    def session(self, connect_class):
+        key = self.key()
+        if key not in self.sessions:
+            self.sessions[key] = connect_class(config.host, config.username, config.password, ssl=config.tls)
+        return self.sessions[key]
+
+    def cluster(self, connect_class, slot: int = 0):
+        key = (self.key(), slot)
+        if key not in self.clusters:
+            self.clusters[key] = self.handle(connect_class, self.session(connect_class)).connect()._cluster
+        return self.clusters[key]
+
+    def get(self, connect_class=CBConnectBatch, bucket: str = None, scope: str = "_default", collection: str = "_default", slot: int = 0):
+        with self.lock:
+            handle = self.handle(connect_class, self.session(connect_class), self.cluster(connect_class, slot))
+            if bucket:
+                key = (self.key(), slot, bucket)
+                if key not in self.buckets:
+                    handle.bucket(bucket)
+                    self.buckets[key] = handle._bucket
+                handle._bucket = self.buckets[key]
+        if bucket:
+            handle.scope(scope)
+            handle.collection(collection)
+        return handle
+
+    async def get_async(self, connect_class=CBConnectAsync, bucket: str = None, scope: str = "_default", collection: str = "_default",
+                        slot: int = 0):
+        with self.lock:
+            session = self.session(connect_class)
+        key = (self.key(), slot, asyncio.get_running_loop())
+        if key not in self.async_clusters:
+            self.async_clusters[key] = (await self.handle(connect_class, session).connect(), {})
+        base, buckets = self.async_clusters[key]
+        handle = self.handle(connect_class, base, base._cluster)
+        if bucket:
+            if bucket not in buckets:
+                buckets[bucket] = await base.open_bucket(bucket)
+            handle._bucket = buckets[bucket]
+            handle.select(scope, collection)
+        return handle
+
+    async def close_async(self):
+        loop = asyncio.get_running_loop()
+        for key in [k for k in self.async_clusters if k[2] is loop]:
+            base, buckets = self.async_clusters.pop(key)
+            await base.close()
+
+    def close(self):
+        with self.lock:
+            for cluster in self.clusters.values():
+                if cluster:
+                    cluster.close()
+            self.reset()
+
+    def reset(self):
+        self.sessions.clear()
+        self.clusters.clear()
+        self.buckets.clear()
+        self.async_clusters.clear()
+
+
+connections = ConnectionRegistry()
@@ -0,0 +1,100 @@
+##
+##
+
+import mmap
+import struct
+import numpy
+from lib.exceptions import ConfigFileError
+
+MAGIC = b'CBPD'
+VERSION = 1
+HEADER = struct.Struct('<4sII')
+ENTRY = struct.Struct('<32sIQQ')
+
+
+def flatten(data: dict, prefix: str = '') -> dict:
+    lists = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            lists.update(flatten(value, name))
+        else:
+            lists[name] = value
+    return lists
+
+
+def write_store(filename: str, data: dict) -> None:
+    lists = flatten(data)
+    position = HEADER.size + ENTRY.size * len(lists)
+    directory = []
+    sections = []
+
+    for name, items in lists.items():
+        encoded = [str(item).encode('utf-8') for item in items]
+        offsets = numpy.zeros(len(encoded) + 1, dtype='<u4')
+        offsets[1:] = numpy.cumsum([len(e) for e in encoded])
+        offsets_pos = position
+        blob_pos = offsets_pos + offsets.nbytes
+        blob = b''.join(encoded)
+        padding = b'\0' * (-(blob_pos + len(blob)) % 8)
+        directory.append(ENTRY.pack(name.encode('utf-8'), len(encoded), offsets_pos, blob_pos))
+        sections.extend([offsets.tobytes(), blob, padding])
+        position = blob_pos + len(blob) + len(padding)
+
+    with open(filename, 'wb') as store_file:
+        store_file.write(HEADER.pack(MAGIC, VERSION, len(lists)))
+        store_file.write(b''.join(directory))
+        store_file.write(b''.join(sections))
+
+
+class DataList(object):
+
+    def __init__(self, buffer: mmap.mmap, count: int, offsets_pos: int, blob_pos: int):
+        self.buffer = buffer
+        self.count = count
+        self.offsets = numpy.frombuffer(buffer, dtype='<u4', count=count + 1, offset=offsets_pos)
+        self.blob_pos = blob_pos
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int):
+        return self.buffer[self.blob_pos + int(self.offsets[index]):self.blob_pos + int(self.offsets[index + 1])].decode('utf-8')
+
+    def take(self, indices: list[int]) -> list[str]:
+        buffer = self.buffer
+        base = self.blob_pos
+        index = numpy.asarray(indices, dtype=numpy.int64)
+        starts = self.offsets[index].tolist()
+        ends = self.offsets[index + 1].tolist()
+        return [buffer[base + s:base + e].decode('utf-8') for s, e in zip(starts, ends)]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+
+class DataStore(object):
+
+    def __init__(self, filename: str):
+        try:
+            with open(filename, 'rb') as store_file:
+                self.buffer = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as err:
+            raise ConfigFileError(f"can not map random data file {filename}: {err}")
+
+        magic, version, count = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ConfigFileError(f"random data file {filename} has an unsupported format")
+
+        self.tree = {}
+        for n in range(count):
+            name, items, offsets_pos, blob_pos = ENTRY.unpack_from(self.buffer, HEADER.size + ENTRY.size * n)
+            path = name.rstrip(b'\0').decode('utf-8').split('.')
+            node = self.tree
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = DataList(self.buffer, items, offsets_pos, blob_pos)
+
+    def get(self, key: str, default=None):
+        return self.tree.get(key, default)
@@ -0,0 +1,171 @@
+##
+##
+
+import math
+import random
+import numpy
+
+
+def expm1_ratio(x: float) -> float:
+    return math.expm1(x) / x if abs(x) > 1e-8 else 1.0 + x / 2.0
+
+
+def log1p_ratio(x: float) -> float:
+    return math.log1p(x) / x if abs(x) > 1e-8 else 1.0 - x / 2.0
+
+
+def expm1_ratios(x: numpy.ndarray) -> numpy.ndarray:
+    small = numpy.abs(x) <= 1e-8
+    return numpy.where(small, 1.0 + x / 2.0, numpy.expm1(x) / numpy.where(small, 1.0, x))
+
+
+def log1p_ratios(x: numpy.ndarray) -> numpy.ndarray:
+    small = numpy.abs(x) <= 1e-8
+    return numpy.where(small, 1.0 - x / 2.0, numpy.log1p(x) / numpy.where(small, 1.0, x))
+
+
+def scatter_stride(n: int) -> int:
+    stride = max(1, round(n * 0.6180339887))
+    while math.gcd(stride, n) != 1:
+        stride += 1
+    return stride
+
+
+class Distribution(object):
+
+    def __init__(self, n: int):
+        self.n = n
+        self.stride = scatter_stride(n)
+
+    def rank(self) -> int:
+        return random.randrange(self.n)
+
+    def ranks(self, count: int, generator: numpy.random.Generator) -> numpy.ndarray:
+        return generator.integers(0, self.n, size=count)
+
+    def index(self, head: int = 0) -> int:
+        return self.rank() * self.stride % self.n
+
+    def indices(self, count: int, generator: numpy.random.Generator, heads: numpy.ndarray = None) -> list[int]:
+        ranks = self.ranks(count, generator)
+        if self.n < (1 << 31):
+            return (ranks * self.stride % self.n).tolist()
+        return [r * self.stride % self.n for r in ranks.tolist()]
+
+
+class Uniform(Distribution):
+
+    def index(self, head: int = 0) -> int:
+        return self.rank()
+
+    def indices(self, count: int, generator: numpy.random.Generator, heads: numpy.ndarray = None) -> list[int]:
+        return self.ranks(count, generator).tolist()
+
+
+class Zipf(Distribution):
+
+    def __init__(self, n: int, s: float = 0.99):
+        super().__init__(n)
+        self.s = s
+        self.h_x1 = self.h_integral(1.5) - 1.0
+        self.h_n = self.h_integral(n + 0.5)
+        self.squeeze = 2.0 - self.h_integral_inverse(self.h_integral(2.5) - self.h(2.0))
+
+    def h(self, x: float) -> float:
+        return math.exp(-self.s * math.log(x))
+
+    def h_integral(self, x: float) -> float:
+        log_x = math.log(x)
+        return expm1_ratio((1.0 - self.s) * log_x) * log_x
+
+    def h_integral_inverse(self, x: float) -> float:
+        return math.exp(log1p_ratio(max(-1.0, x * (1.0 - self.s))) * x)
+
+    def rank(self) -> int:
+        while True:
+            u = self.h_n + random.random() * (self.h_x1 - self.h_n)
+            x = self.h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), self.n)
+            if k - x <= self.squeeze or u >= self.h_integral(k + 0.5) - self.h(k):
+                return k - 1
+
+    def ranks(self, count: int, generator: numpy.random.Generator) -> numpy.ndarray:
+        result = numpy.empty(count, dtype=numpy.int64)
+        pending = numpy.arange(count)
+        while len(pending):
+            u = self.h_n + generator.random(len(pending)) * (self.h_x1 - self.h_n)
+            x = numpy.exp(log1p_ratios(numpy.maximum(-1.0, u * (1.0 - self.s))) * u)
+            k = numpy.clip(numpy.floor(x + 0.5), 1, self.n)
+            log_k = numpy.log(k + 0.5)
+            accept = (k - x <= self.squeeze) | (u >= expm1_ratios((1.0 - self.s) * log_k) * log_k - numpy.exp(-self.s * numpy.log(k)))
+            result[pending[accept]] = k[accept] - 1
+            pending = pending[~accept]
+        return result
+
+
+class Exponential(Distribution):
+
+    def __init__(self, n: int, percentile: float = 0.95, fraction: float = 0.1):
+        super().__init__(n)
+        self.gamma = -math.log(1.0 - percentile) / (fraction * n)
+        self.mass = -math.expm1(-self.gamma * n)
+
+    def rank(self) -> int:
+        return min(int(-math.log1p(-random.random() * self.mass) / self.gamma), self.n - 1)
+
+    def ranks(self, count: int, generator: numpy.random.Generator) -> numpy.ndarray:
+        ranks = numpy.floor(-numpy.log1p(-generator.random(count) * self.mass) / self.gamma)
+        return numpy.minimum(ranks, self.n - 1).astype(numpy.int64)
+
+
+class HotSpot(Distribution):
+
+    def __init__(self, n: int, hot_fraction: float = 0.2, hot_probability: float = 0.8):
+        super().__init__(n)
+        self.hot = min(n, max(1, int(n * hot_fraction)))
+        self.hot_probability = hot_probability
+
+    def rank(self) -> int:
+        if random.random() < self.hot_probability or self.hot == self.n:
+            return random.randrange(self.hot)
+        return random.randrange(self.hot, self.n)
+
+    def ranks(self, count: int, generator: numpy.random.Generator) -> numpy.ndarray:
+        hot = generator.integers(0, self.hot, size=count)
+        if self.hot == self.n:
+            return hot
+        cold = generator.integers(self.hot, self.n, size=count)
+        return numpy.where(generator.random(count) < self.hot_probability, hot, cold)
+
+
+class Latest(Zipf):
+
+    def index(self, head: int = 0) -> int:
+        return (head - self.rank()) % self.n
+
+    def indices(self, count: int, generator: numpy.random.Generator, heads: numpy.ndarray = None) -> list[int]:
+        return ((heads - self.ranks(count, generator)) % self.n).tolist()
+
+
+distributions = {
+    "uniform": Uniform,
+    "zipf": Zipf,
+    "hotspot": HotSpot,
+    "exponential": Exponential,
+    "latest": Latest,
+}
+distribution_args = {
+    "uniform": (),
+    "zipf": (("s", lambda v: v > 0),),
+    "hotspot": (("hot_fraction", lambda v: 0 < v <= 1), ("hot_probability", lambda v: 0 <= v <= 1)),
+    "exponential": (("percentile", lambda v: 0 < v < 1), ("fraction", lambda v: 0 < v <= 1)),
+    "latest": (("s", lambda v: v > 0),),
+}
+distribution_cache = {}
+
+
+def get_distribution(name: str, n: int, args: tuple = ()) -> Distribution:
+    key = (name, n, args)
+    if key not in distribution_cache:
+        distribution_cache[key] = distributions[name](n, *args)
+    return distribution_cache[key]
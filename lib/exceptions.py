@@ -86,3 +86,11 @@ class PluginImportError(FatalError):
 
 class KeyFormatError(FatalError):
     pass
+
+
+class StatsFileError(FatalError):
+    pass
+
+
+class CheckpointError(FatalError):
+    pass
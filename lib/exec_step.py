@@ -2,10 +2,23 @@
 ##
 
 import logging
+import json
+import threading
 import time
 import re
+import numpy
 from jinja2 import Template
 from cbcmgr.cb_connect import CBConnect
+from lib.exceptions import StatsFileError
+
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+HISTOGRAM_BITS = 36
+HISTOGRAM_LIMIT = (1 << HISTOGRAM_BITS) - 1
+HISTOGRAM_SIZE = ((HISTOGRAM_BITS - SUB_BUCKET_BITS) << (SUB_BUCKET_BITS - 1)) + SUB_BUCKET_COUNT
+thread_stats = threading.local()
+stats_tables = []
+timings = {}
 
 
 class DBRead(object):
@@ -18,7 +31,9 @@ class DBRead(object):
         self._result = None
 
     def execute(self, key: str):
+        begin_time = time.perf_counter()
         self._result = self.db.cb_get(key)
+        operation_stats("get").add(time.perf_counter() - begin_time)
         self.add_key(key)
 
     @property
@@ -36,34 +51,85 @@ class DBRead(object):
 
 class DBWrite(object):
 
-    def __init__(self, db: CBConnect, id_field: str = "record_id"):
+    def __init__(self, db: CBConnect, id_field: str = "record_id", name: str = None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.id_field = id_field
         self.db = db
+        self.name = name
         self._result = None
 
-    def execute(self, key: str, document: dict, no_squash: bool = False):
-        if no_squash:
-            if self.db.cb_doc_exists(key):
-                return None
+    @staticmethod
+    def id_value(key: str):
         try:
             number = re.split(':', key)[-1]
-            id_value = int(number)
+            return int(number)
         except (ValueError, TypeError):
-            id_value = key
-        begin_time = time.time()
-        document[self.id_field] = id_value
-        self._result = self.db.cb_upsert(key, document)
-        end_time = time.time()
-        total_time = end_time - begin_time
-        self.logger.debug(f"write complete in {total_time:.6f}")
+            return key
+
+    def documents(self, items: list) -> dict:
+        documents = {}
+        for key, document in items:
+            document_id = self.db.construct_key(key)
+            document[self.id_field] = self.id_value(key)
+            documents[document_id] = document
+        return documents
+
+    def execute_many(self, items: list, no_squash: bool = False) -> dict:
+        documents = self.documents(items)
+        begin_time = time.perf_counter()
+        if not documents:
+            self._result = {}
+        elif no_squash:
+            self._result = self.inserted(self.db.cb_insert_multi(documents))
+        else:
+            self._result = self.db.cb_upsert_multi(documents)
+        self.record_many(time.perf_counter() - begin_time, len(documents), no_squash)
         return self._result
 
+    def record_many(self, latency: float, count: int, no_squash: bool):
+        operation_stats("insert" if no_squash else "upsert").add(latency, count)
+        if self.name:
+            stats = operation_stats(self.name)
+            stats.add(latency, count)
+            stats.errors += list(self._result.values()).count(False)
+
+    @staticmethod
+    def inserted(status: dict) -> dict:
+        return {key: value for key, value in status.items() if value is not None}
+
     @property
     def result(self):
         return self._result
 
 
+class DBReadAsync(DBRead):
+
+    async def execute(self, key: str):
+        begin_time = time.perf_counter()
+        self._result = await self.db.cb_get(key)
+        operation_stats("get").add(time.perf_counter() - begin_time)
+        self.add_key(key)
+
+    async def fetch(self, key: str):
+        await self.execute(key)
+        return self.result
+
+
+class DBWriteAsync(DBWrite):
+
+    async def execute_many(self, items: list, no_squash: bool = False) -> dict:
+        documents = self.documents(items)
+        begin_time = time.perf_counter()
+        if not documents:
+            self._result = {}
+        elif no_squash:
+            self._result = self.inserted(await self.db.cb_insert_multi(documents))
+        else:
+            self._result = await self.db.cb_upsert_multi(documents)
+        self.record_many(time.perf_counter() - begin_time, len(documents), no_squash)
+        return self._result
+
+
 class DBQuery(object):
 
     def __init__(self, db: CBConnect, query: str, **kwargs):
@@ -77,7 +143,9 @@ class DBQuery(object):
         if self.query_params:
             t = Template(self.query)
             self.query = t.render(**self.query_params)
+        begin_time = time.perf_counter()
         self._result = self.db.cb_query(sql=self.query)
+        operation_stats("query").add(time.perf_counter() - begin_time)
 
     @property
     def keyspace(self):
@@ -86,3 +154,177 @@ class DBQuery(object):
     @property
     def result(self):
         return self._result
+
+
+def timed_call(func, *args):
+    begin_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - begin_time
+
+
+def scheduled_call(start_time: float, func, *args):
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+async def async_scheduled_call(start_time: float, func, *args):
+    result = await func(*args)
+    return result, time.perf_counter() - start_time
+
+
+class LatencyHistogram(object):
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_SIZE
+        self.total = 0
+        self.max_value = 0
+
+    @staticmethod
+    def bucket(value: int) -> int:
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def bucket_value(index: int) -> int:
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+        return ((index - (shift << (SUB_BUCKET_BITS - 1)) + 1) << shift) - 1
+
+    def record(self, latency: float, count: int = 1):
+        value = min(max(int(latency * 1000000), 0), HISTOGRAM_LIMIT)
+        self.counts[self.bucket(value)] += count
+        self.total += count
+        if value > self.max_value:
+            self.max_value = value
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts = (numpy.array(self.counts) + numpy.array(other.counts)).tolist()
+        self.total += other.total
+        self.max_value = max(self.max_value, other.max_value)
+
+    def interval(self, previous: list) -> "LatencyHistogram":
+        result = LatencyHistogram()
+        counts = numpy.array(self.counts) - numpy.array(previous)
+        result.counts = counts.tolist()
+        result.total = int(counts.sum())
+        result.max_value = self.bucket_value(int(numpy.flatnonzero(counts)[-1])) if result.total else 0
+        return result
+
+    def value_at(self, p: float) -> int:
+        if not self.total:
+            return 0
+        rank = max(1, int(numpy.ceil(p / 100 * self.total)))
+        index = int(numpy.searchsorted(numpy.cumsum(self.counts), rank))
+        return min(self.bucket_value(index), self.max_value)
+
+
+class LatencyStats(object):
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.pending = 0
+        self.begin_time = time.perf_counter()
+        self.end_time = None
+
+    def add(self, latency: float, count: int = 1):
+        self.histogram.record(latency, count)
+
+    def merge(self, other: "LatencyStats"):
+        self.begin_time = min(self.begin_time, other.begin_time) if self.count else other.begin_time
+        if other.end_time or self.end_time:
+            self.end_time = max(self.end_time or 0, other.end_time or time.perf_counter())
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+
+    def start(self):
+        if not self.count:
+            self.begin_time = time.perf_counter()
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    @property
+    def count(self):
+        return self.histogram.total
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.perf_counter()) - self.begin_time
+
+    @property
+    def ops_per_second(self):
+        return self.count / max(self.elapsed, 1e-9)
+
+    def percentile(self, p: float) -> float:
+        return self.histogram.value_at(p) / 1000
+
+    def summary(self) -> str:
+        return (f"{self.count} ops in {self.elapsed:.2f} seconds ({self.ops_per_second:.0f} ops/sec) "
+                f"latency ms p50 {self.percentile(50):.3f} p90 {self.percentile(90):.3f} p99 {self.percentile(99):.3f} "
+                f"p99.9 {self.percentile(99.9):.3f} max {self.percentile(100):.3f}")
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "elapsed": round(self.elapsed, 3),
+            "ops_per_second": round(self.ops_per_second, 1),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p99.9": self.percentile(99.9),
+            "max": self.percentile(100),
+        }
+
+
+def operation_stats(name: str) -> LatencyStats:
+    try:
+        table = thread_stats.table
+    except AttributeError:
+        table = thread_stats.table = {}
+        stats_tables.append(table)
+    if name not in table:
+        table[name] = LatencyStats()
+    return table[name]
+
+
+def collect_stats() -> dict:
+    merged = {}
+    for table in list(stats_tables):
+        for name, stats in list(table.items()):
+            merged.setdefault(name, LatencyStats()).merge(stats)
+    return merged
+
+
+def merge_stats(results: dict):
+    for name, stats in results.items():
+        operation_stats(name).merge(stats)
+
+
+def reset_stats():
+    stats_tables.clear()
+    thread_stats.__dict__.clear()
+    timings.clear()
+
+
+def record_timing(name: str, seconds: float):
+    timings[name] = round(seconds, 3)
+
+
+def write_stats(filename: str, command: str):
+    results = {
+        "command": command,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "operations": {name: stats.as_dict() for name, stats in sorted(collect_stats().items())},
+        "timings": timings
+    }
+    try:
+        with open(filename, 'w') as stats_file:
+            json.dump(results, stats_file, indent=2)
+            stats_file.write('\n')
+    except OSError as err:
+        raise StatsFileError(f"can not write stats file {filename}: {err}")
@@ -6,10 +6,12 @@ import sys
 from enum import Enum
 import pandas as pd
 import json
+import asyncio
 import concurrent.futures
 from lib.exceptions import ExportException, ExportError
 from cbcmgr.cb_connect import CBConnect
 from cbcmgr.cb_management import CBManager
+from lib.connect import connections
 import lib.config as config
 from lib.main import MainLoop
 from lib.schema import ProcessSchema
@@ -27,7 +29,7 @@ class CBExport(object):
         self.logger = logging.getLogger(self.__class__.__name__)
 
         try:
-            self.db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect()
+            self.db = connections.get(CBConnect)
         except Exception as err:
             raise ExportException(f"can not connect to Couchbase: {err}")
 
@@ -79,6 +81,12 @@ class CBExport(object):
                     db_op = DBRead(self.db, add_key=True)
                     doc_id_list = query_op.result
 
+                    if not config.sync_mode:
+                        keys = [doc_id['id'] for doc_id in doc_id_list]
+                        results = asyncio.run(MainLoop.fetch_async(bucket.name, scope.name, collection.name, keys, add_key=True))
+                        data.extend([result for result in results if result])
+                        doc_id_list = []
+
                     for n in range(1, len(doc_id_list) + 1, run_batch_size):
                         tasks.clear()
                         for b in range(n, n + run_batch_size):
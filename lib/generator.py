@@ -0,0 +1,129 @@
+##
+##
+
+import logging
+import multiprocessing
+import queue
+import json
+import gzip
+import os
+from typing import Union
+import numpy
+import lib.randomize as rand
+from lib.template import DocTemplate
+from lib.distribution import distributions
+from lib.exceptions import TestRunError
+
+
+def generate_range(block: dict, start: int, count: int, block_size: int, seed: numpy.random.SeedSequence, unique: tuple, images: list,
+                   output: multiprocessing.Queue):
+    rand.rand_init()
+    rand.seed_generators(seed)
+    rand.set_unique_stream(*unique)
+    rand.image_pool = images
+    rand.prepare_template(block)
+    end = start + count
+    for n in range(start, end, block_size):
+        size = min(block_size, end - n)
+        output.put((n, rand.generate_batch(size, start=n)))
+    output.put(None)
+
+
+def write_range(block: dict, start: int, count: int, block_size: int, seed: numpy.random.SeedSequence, unique: tuple, images: list,
+                filename: str, output: multiprocessing.Queue):
+    rand.rand_init()
+    rand.seed_generators(seed)
+    rand.set_unique_stream(*unique)
+    rand.image_pool = images
+    rand.prepare_template(block)
+    end = start + count
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'wt', encoding='utf-8') as shard:
+        for n in range(start, end, block_size):
+            size = min(block_size, end - n)
+            shard.write(''.join([json.dumps(document) + '\n' for document in rand.generate_batch(size, start=n)]))
+    output.put((filename, start, count))
+    output.put(None)
+
+
+def read_shard(filename: str, block_size: int = 1000):
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', encoding='utf-8') as shard:
+        documents = []
+        for line in shard:
+            documents.append(json.loads(line))
+            if len(documents) == block_size:
+                yield documents
+                documents = []
+        if documents:
+            yield documents
+
+
+class GeneratorPool(object):
+
+    def __init__(self, processes: int, block_size: int = 1000, seed: Union[int, None] = None, start_method: str = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.processes = processes
+        self.block_size = block_size
+        self.seed = numpy.random.SeedSequence(seed)
+        self.context = multiprocessing.get_context(start_method)
+
+    @staticmethod
+    def split_range(start: int, count: int, parts: int) -> list[tuple[int, int]]:
+        ranges = []
+        size, extra = divmod(count, parts)
+        for n in range(parts):
+            part_count = size + (1 if n < extra else 0)
+            if part_count > 0:
+                ranges.append((start, part_count))
+            start += part_count
+        return ranges
+
+    def blocks(self, block: dict, start: int, count: int):
+        yield from self.run(generate_range, block, start, count)
+
+    def write_shards(self, block: dict, start: int, count: int, prefix: str, compress: bool = False) -> list[dict]:
+        extension = '.ndjson.gz' if compress else '.ndjson'
+        files = [(f"{prefix}.{n:04d}{extension}",) for n in range(self.processes)]
+        shards = [{"file": os.path.basename(filename), "start": range_start, "count": range_count}
+                  for filename, range_start, range_count in self.run(write_range, block, start, count, files)]
+        return sorted(shards, key=lambda s: s['start'])
+
+    def run(self, target, block: dict, start: int, count: int, extra: list[tuple] = None):
+        ranges = self.split_range(start, count, self.processes)
+        seeds = self.seed.spawn(len(ranges))
+        output = self.context.Queue(maxsize=self.processes * 4)
+        images = rand.load_image_pool() if 'rand_image' in DocTemplate(block, frozenset(distributions)).tokens else []
+        workers = []
+
+        for index, ((range_start, range_count), seed) in enumerate(zip(ranges, seeds)):
+            self.logger.debug(f"generator: range {range_start} count {range_count}")
+            unique = (rand.unique_key, index == 0 and start == 1)
+            args = (block, range_start, range_count, self.block_size, seed, unique, images)
+            if extra:
+                args = args + extra[index]
+            worker = self.context.Process(target=target,
+                                          args=args + (output,),
+                                          daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        try:
+            running = len(workers)
+            while running > 0:
+                try:
+                    item = output.get(timeout=1)
+                except queue.Empty:
+                    failed = [w for w in workers if w.exitcode is not None and w.exitcode != 0]
+                    if failed:
+                        raise TestRunError(f"document generator process exited with code {failed[0].exitcode}")
+                    continue
+                if item is None:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
@@ -2,33 +2,97 @@
 #
 
 import logging
+import asyncio
 import json
+import os
+import time
 import re
 import sys
 import io
 import itertools as it
 import concurrent.futures
+import multiprocessing
+import queue
+import numpy
 from functools import partial
 import lib.config as config
 import lib.randomize as rand
+from couchbase.exceptions import CouchbaseException
 from cbcmgr.cb_connect import CBConnect
 from cbcmgr.cb_management import CBManager
+from lib.connect import CBConnectBatch, CBConnectAsync, CBIndexManager, connections
 from lib.exceptions import TestRunError
-from lib.exec_step import DBRead, DBWrite, DBQuery
+from lib.exec_step import DBRead, DBWrite, DBQuery, DBReadAsync, DBWriteAsync, LatencyStats, scheduled_call, async_scheduled_call
+from lib.exec_step import operation_stats, collect_stats, merge_stats, reset_stats, record_timing
+from lib.ratelimit import RateLimiter
+from lib.reporter import IntervalReporter
+from lib.logging import CustomFormatter
+from lib.checkpoint import Checkpoint, RangeCheckpoint
+from lib.workload import KVWorkload, QueryWorkload
 from lib.schema import Bucket, Scope, Collection
 from lib.schema import ProcessSchema, CollectionDoc
 from lib.keyformat import KeyStyle, KeyFormat
+from lib.generator import GeneratorPool, read_shard
+
+
+LOAD_START_METHOD = "spawn"
+
+
+def worker_init(settings: dict, log_level: int):
+    config.apply_settings(settings)
+    logger = logging.getLogger()
+    logger.setLevel(log_level)
+    if not logger.handlers:
+        screen_handler = logging.StreamHandler()
+        screen_handler.setFormatter(CustomFormatter())
+        logger.addHandler(screen_handler)
+
+
+def load_range(block: dict, start: int, count: int, block_size: int, seed, unique: tuple, images: list, settings: dict, keyspace: tuple, key_info: tuple,
+               log_level: int, output):
+    worker_init(settings, log_level)
+    reset_stats()
+    loop = MainLoop()
+    rand.seed_generators(seed)
+    rand.set_unique_stream(*unique)
+    rand.image_pool = images
+    rand.prepare_template(block)
+    stats = LatencyStats()
+    progress = RangeCheckpoint(start, output)
+    blocks = loop.generate_blocks(start, count, block_size)
+    with IntervalReporter(f"{keyspace[2]}:{start}", [stats]):
+        inserted, submitted = loop.write(*keyspace, loop.key_blocks(progress.track(blocks), *key_info), stats, checkpoint=progress)
+    progress.save()
+    output.put((inserted, submitted, stats, collect_stats()))
+    output.put(None)
+
+
+def load_collection(settings: dict, bucket: Bucket, scope: Scope, collection: Collection, budget, log_level: int, output):
+    worker_init(settings, log_level)
+    reset_stats()
+    rand.seed_generators(numpy.random.SeedSequence())
+    loop = MainLoop(budget)
+    loop.process(bucket, scope, collection)
+    loop.post_process(bucket, scope, collection)
+    output.put((MainLoop.keyspace_name(bucket, scope, collection), collect_stats()))
 
 
 class MainLoop(object):
 
-    def __init__(self):
+    def __init__(self, budget=None):
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.budget = budget
         rand.rand_init()
+        rand.set_image_pool(config.image_pool_size,
+                            config.image_width,
+                            config.image_height,
+                            config.image_format,
+                            config.image_cache_dir,
+                            config.generator_processes)
 
     @staticmethod
     def prep_bucket(bucket, scope, collection, quota: int = 256):
-        dbm = CBManager(config.host, config.username, config.password, ssl=config.tls).connect()
+        dbm = connections.get(CBIndexManager)
         dbm.create_bucket(bucket, quota)
         dbm.create_scope(scope)
         dbm.create_collection(collection)
@@ -48,8 +112,182 @@ class MainLoop(object):
                     raise TestRunError(f"task failed: {err}")
         return result_set
 
+    def task_drain(self, tasks: set, stats: LatencyStats, limit: int = 0) -> int:
+        completed = 0
+        while len(tasks) > limit:
+            done, pending = concurrent.futures.wait(tasks, return_when=concurrent.futures.FIRST_COMPLETED)
+            tasks.difference_update(done)
+            completed += self.task_results(done, stats)
+        return completed
+
+    async def async_drain(self, tasks: set, stats: LatencyStats, limit: int = 0) -> int:
+        completed = 0
+        while len(tasks) > limit:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            tasks.difference_update(done)
+            completed += self.task_results(done, stats)
+        return completed
+
+    def task_results(self, done: set, stats: LatencyStats) -> int:
+        completed = 0
+        for task in done:
+            try:
+                result, latency = task.result()
+            except Exception as err:
+                self.logger.error(f"task error: {type(err).__name__}: {err}")
+                raise TestRunError(f"task failed: {err}")
+            stats.add(latency, len(result))
+            stats.pending -= 1
+            completed += sum(result.values())
+            stats.errors += len(result) - sum(result.values())
+        return completed
+
+    def release_budget(self, task):
+        self.budget.release()
+
+    @staticmethod
+    def connection_name(n: int):
+        return f"conn.{n}" if config.connection_count > 1 else None
+
+    def connection_report(self):
+        if config.connection_count < 2:
+            return
+        results = collect_stats()
+        for n in range(config.connection_count):
+            stats = results.get(f"conn.{n}")
+            if stats and stats.count:
+                self.logger.info(f"Connection {n} failed {stats.errors}: {stats.summary()}")
+
+    @staticmethod
+    def write_batches(items: list):
+        for n in range(0, len(items), config.write_batch):
+            yield items[n:n + config.write_batch]
+
+    def write(self, bucket: str, scope: str, collection: str, id_field: str, blocks, stats: LatencyStats, concurrency: int = None,
+              checkpoint: Checkpoint = None) -> tuple[int, int]:
+        if config.sync_mode:
+            return self.write_sync(bucket, scope, collection, id_field, blocks, stats, concurrency, checkpoint)
+        return asyncio.run(self.closing(self.write_async(bucket, scope, collection, id_field, blocks, stats, concurrency, checkpoint)))
+
+    @staticmethod
+    async def closing(operation):
+        try:
+            return await operation
+        finally:
+            await connections.close_async()
+
+    def write_sync(self, bucket: str, scope: str, collection: str, id_field: str, blocks, stats: LatencyStats, concurrency: int = None,
+                   checkpoint: Checkpoint = None) -> tuple[int, int]:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency or config.batch_size)
+        window = concurrency - 1 if concurrency else max(1, config.batch_size * 10 // config.write_batch) - 1
+        inserted = 0
+        submitted = 0
+        tasks = set()
+
+        try:
+            dbs = [connections.get(CBConnectBatch, bucket, scope, collection, slot=n) for n in range(config.connection_count)]
+        except Exception as err:
+            raise TestRunError(f"can not connect to Couchbase: {err}")
+
+        db_ops = it.cycle([DBWrite(db, id_field, self.connection_name(n)) for n, db in enumerate(dbs)])
+        limiter = RateLimiter(config.ops_rate)
+        stats.start()
+        for items in blocks:
+            record = checkpoint.current if checkpoint else 0
+            for batch in self.write_batches(items):
+                if not config.barrier_mode:
+                    inserted += self.task_drain(tasks, stats, window)
+                start_time = limiter.wait(len(batch))
+                if self.budget:
+                    self.budget.acquire()
+                task = executor.submit(scheduled_call, start_time, next(db_ops).execute_many, batch, config.safe_mode)
+                if self.budget:
+                    task.add_done_callback(self.release_budget)
+                if checkpoint:
+                    task.add_done_callback(partial(checkpoint.task_done, record, len(batch)))
+                tasks.add(task)
+                stats.pending += 1
+                submitted += len(batch)
+                record += len(batch)
+            if config.barrier_mode:
+                inserted += self.task_drain(tasks, stats)
+        inserted += self.task_drain(tasks, stats)
+        executor.shutdown()
+
+        return inserted, submitted
+
+    async def write_async(self, bucket: str, scope: str, collection: str, id_field: str, blocks, stats: LatencyStats, concurrency: int = None,
+                          checkpoint: Checkpoint = None) -> tuple[int, int]:
+        loop = asyncio.get_running_loop()
+        window = concurrency - 1 if concurrency else max(1, config.batch_size * 10 // config.write_batch) - 1
+        inserted = 0
+        submitted = 0
+        tasks = set()
+
+        try:
+            dbs = [await connections.get_async(CBConnectAsync, bucket, scope, collection, slot=n) for n in range(config.connection_count)]
+        except Exception as err:
+            raise TestRunError(f"can not connect to Couchbase: {err}")
+
+        db_ops = it.cycle([DBWriteAsync(db, id_field, self.connection_name(n)) for n, db in enumerate(dbs)])
+        limiter = RateLimiter(config.ops_rate)
+        stats.start()
+        while True:
+            items = await loop.run_in_executor(None, next, blocks, None)
+            if items is None:
+                break
+            record = checkpoint.current if checkpoint else 0
+            for batch in self.write_batches(items):
+                if not config.barrier_mode:
+                    inserted += await self.async_drain(tasks, stats, window)
+                start_time = await limiter.async_wait(len(batch))
+                if self.budget:
+                    while not self.budget.acquire(False):
+                        if tasks:
+                            inserted += await self.async_drain(tasks, stats, len(tasks) - 1)
+                        else:
+                            await asyncio.sleep(0.001)
+                task = asyncio.ensure_future(async_scheduled_call(start_time, next(db_ops).execute_many, batch, config.safe_mode))
+                if self.budget:
+                    task.add_done_callback(self.release_budget)
+                if checkpoint:
+                    task.add_done_callback(partial(checkpoint.task_done, record, len(batch)))
+                tasks.add(task)
+                stats.pending += 1
+                submitted += len(batch)
+                record += len(batch)
+            if config.barrier_mode:
+                inserted += await self.async_drain(tasks, stats)
+        inserted += await self.async_drain(tasks, stats)
+
+        return inserted, submitted
+
+    @staticmethod
+    async def fetch_async(bucket: str, scope: str, collection: str, keys: list, add_key: bool = False, stats: LatencyStats = None) -> list:
+        limit = asyncio.Semaphore(config.batch_size * 10)
+        limiter = RateLimiter(config.ops_rate)
+
+        try:
+            db = await connections.get_async(CBConnectAsync, bucket, scope, collection)
+        except Exception as err:
+            raise TestRunError(f"can not connect to Couchbase: {err}")
+
+        db_op = DBReadAsync(db, add_key=add_key)
+
+        async def fetch(key: str):
+            start_time = await limiter.async_wait()
+            async with limit:
+                result, latency = await async_scheduled_call(start_time, db_op.fetch, key)
+            if stats:
+                stats.add(latency)
+            return result
+
+        results = await asyncio.gather(*[fetch(key) for key in keys])
+        await connections.close_async()
+        return results
+
     def schema_remove(self):
-        dbm = CBManager(config.host, config.username, config.password, ssl=config.tls).connect()
+        dbm = connections.get(CBManager)
         if config.schema_name:
             bucket_list = [b.name for b in config.schema.buckets]
         else:
@@ -72,6 +310,8 @@ class MainLoop(object):
                         print(f"      > Collection: {collection.name}")
                         if collection.override_count:
                             print(f"        Document Count: {collection.record_count}")
+                        for query in collection.queries or []:
+                            print(f"        Query {query.name}: {query.statement}")
                         print(f"        Schema:")
                         json_output = json.dumps(collection.schema, indent=2)
                         lines = json_output.split('\n')
@@ -111,46 +351,148 @@ class MainLoop(object):
 
     def schema_load(self):
         self.logger.info("Processing buckets")
-        for bucket in config.schema.buckets:
-            for scope in bucket.scopes:
-                for collection in scope.collections:
-                    self.logger.info(f"Processing bucket {bucket.name} scope {scope.name} collection {collection.name}")
-                    self.pre_process(bucket, scope, collection)
-                    self.process(bucket, scope, collection)
-                    self.post_process(bucket, scope, collection)
+        if config.load_parallel > 1:
+            self.schema_load_parallel()
+            return
+        collections = [(bucket, scope, collection) for bucket in config.schema.buckets for scope in bucket.scopes for collection in scope.collections]
+        for bucket, scope, collection in collections:
+            self.logger.info(f"Processing bucket {bucket.name} scope {scope.name} collection {collection.name}")
+            if not config.skip_init:
+                self.pre_process(bucket, scope, collection)
+            self.process(bucket, scope, collection)
+            self.post_process(bucket, scope, collection)
+        self.connection_report()
+        if config.defer_index:
+            self.build_indexes(collections)
         self.logger.info("Processing rules")
         for rule in config.schema.rules:
-            if rule.type == "link":
-                self.logger.info(f"Running link rule {rule.name}")
-                self.run_link_rule(rule.id_field, rule.primary_key, rule.foreign_key)
-            elif rule.type == "sql":
-                self.logger.info(f"Running sql rule {rule.name}")
-                self.run_sql_rule(rule.sql)
+            self.run_rule(rule)
+
+    def schema_load_parallel(self):
+        collections = [(bucket, scope, collection) for bucket in config.schema.buckets for scope in bucket.scopes for collection in scope.collections]
+        keyspaces = [self.keyspace_name(*c) for c in collections]
+        rules = [(rule, self.rule_keyspaces(rule, keyspaces)) for rule in config.schema.rules]
+        context = multiprocessing.get_context(LOAD_START_METHOD)
+        budget = context.BoundedSemaphore(max(1, config.batch_size * 10 // config.write_batch))
+        output = context.Queue()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(rules)))
+        pending = list(collections)
+        running = {}
+        loaded = set()
+        rule_tasks = set()
+        settings = dict(config.settings(), ops_rate=config.ops_rate / min(config.load_parallel, len(collections)))
+        begin_time = time.perf_counter()
+
+        if not config.skip_init:
+            for bucket, scope, collection in collections:
+                self.logger.info(f"Preparing bucket {bucket.name} scope {scope.name} collection {collection.name}")
+                self.pre_process(bucket, scope, collection)
+
+        try:
+            while pending or running:
+                while pending and len(running) < config.load_parallel:
+                    bucket, scope, collection = pending.pop(0)
+                    self.logger.info(f"Processing bucket {bucket.name} scope {scope.name} collection {collection.name}")
+                    worker = context.Process(target=load_collection, args=(settings, bucket, scope, collection, budget, logging.getLogger().level, output))
+                    worker.start()
+                    running[self.keyspace_name(bucket, scope, collection)] = worker
+                try:
+                    name, results = output.get(timeout=1)
+                except queue.Empty:
+                    failed = [w for w in running.values() if w.exitcode is not None and w.exitcode != 0]
+                    if failed:
+                        raise TestRunError(f"collection load process exited with code {failed[0].exitcode}")
+                    continue
+                running.pop(name).join()
+                merge_stats(results)
+                loaded.add(name)
+                for rule, references in [r for r in rules if r[1] <= loaded and not config.defer_index]:
+                    rules.remove((rule, references))
+                    rule_tasks.add(executor.submit(self.run_rule, rule))
+        finally:
+            for worker in running.values():
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+        self.connection_report()
+        if config.defer_index:
+            self.build_indexes(collections)
+        for rule, references in rules:
+            rule_tasks.add(executor.submit(self.run_rule, rule))
+        for task in concurrent.futures.as_completed(rule_tasks):
+            task.result()
+        executor.shutdown()
+        self.logger.info(f"Loaded {len(collections)} collections in {time.perf_counter() - begin_time:.2f} seconds")
+
+    @staticmethod
+    def keyspace_name(bucket: Bucket, scope: Scope, collection: Collection) -> str:
+        return f"{bucket.name}.{scope.name}.{collection.name}"
+
+    @staticmethod
+    def rule_keyspaces(rule, keyspaces: list) -> set:
+        if rule.type == "link":
+            references = {'.'.join(key.split(':')[:3]) for key in (rule.primary_key, rule.foreign_key)}
+        else:
+            references = {k for k in keyspaces if re.search(rf"(?<![\w.]){re.escape(k)}(?![\w.])", rule.sql or '')}
+        return (references & set(keyspaces)) or set(keyspaces)
+
+    def run_rule(self, rule):
+        if rule.type == "link":
+            self.logger.info(f"Running link rule {rule.name}")
+            self.run_link_rule(rule.id_field, rule.primary_key, rule.foreign_key)
+        elif rule.type == "sql":
+            self.logger.info(f"Running sql rule {rule.name}")
+            self.run_sql_rule(rule.sql)
 
     def pre_process(self, bucket: Bucket, scope: Scope, collection: Collection):
         self.logger.info("Creating bucket structure")
         dbm = self.prep_bucket(bucket.name, scope.name, collection.name, config.bucket_quota)
 
         self.logger.info("Processing indexes")
+        deferred = "deferred " if config.defer_index else ""
         if collection.primary_index:
-            dbm.cb_create_primary_index(replica=config.replicas)
-            self.logger.info(f"Created primary index on {collection.name}")
+            dbm.cb_create_primary_index(replica=config.replicas, deferred=config.defer_index)
+            self.logger.info(f"Created {deferred}primary index on {collection.name}")
         if collection.indexes:
             for index in collection.indexes:
-                index_name = dbm.cb_create_index(fields=[index], replica=config.replicas)
+                index_name = dbm.cb_create_index(fields=[index], replica=config.replicas, deferred=config.defer_index)
                 if not index_name:
                     self.logger.info(f"Index already exists on field {index}")
                 else:
                     collection.add_index_name(index_name)
-                    self.logger.info(f"Created index {index_name} on {index}")
+                    self.logger.info(f"Created {deferred}index {index_name} on {index}")
+
+    def build_indexes(self, collections: list):
+        indexed = []
+        begin_time = time.perf_counter()
+        for bucket, scope, collection in collections:
+            if not collection.primary_index and not collection.indexes:
+                continue
+            dbm = connections.get(CBIndexManager, bucket.name, scope.name, collection.name)
+            self.logger.info(f"Building deferred indexes on {dbm.keyspace}")
+            dbm.cb_build_deferred_indexes()
+            indexed.append((dbm, collection))
+        for dbm, collection in indexed:
+            try:
+                if collection.primary_index:
+                    dbm.cb_watch_indexes([], primary=True)
+                if collection.indexes:
+                    dbm.cb_watch_indexes([dbm.index_name([index]) for index in collection.indexes])
+            except CouchbaseException as err:
+                raise TestRunError(f"indexes on {dbm.keyspace} did not come online: {err}")
+        if indexed:
+            elapsed = time.perf_counter() - begin_time
+            record_timing("index_build", elapsed)
+            self.logger.info(f"Built indexes on {len(indexed)} collections in {elapsed:.2f} seconds")
 
     def process(self, bucket: Bucket, scope: Scope, collection: Collection):
         last_batch = 0
         inserted_total = 0
-        skipped_count = 0
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.batch_size)
+        submitted_total = 0
         run_batch_size = config.batch_size * 10
-        tasks = set()
+        key_prefix = bucket.name if collection.name == "_default" else collection.name
+        stats = LatencyStats()
         schema_list: list[CollectionDoc]
 
         if type(collection.schema) == list:
@@ -158,14 +500,9 @@ class MainLoop(object):
         else:
             schema_list = [collection.schema]
 
-        for schema in schema_list:
+        for schema_index, schema in enumerate(schema_list):
             rand.prepare_template(schema.doc)
 
-            try:
-                db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect(bucket.name, scope.name, collection.name)
-            except Exception as err:
-                raise TestRunError(f"can not connect to Couchbase: {err}")
-
             if schema.override_count:
                 operation_count = schema.record_count
             else:
@@ -179,38 +516,254 @@ class MainLoop(object):
             else:
                 key_format = KeyStyle.DEFAULT
 
-            db_op = DBWrite(db, collection.idkey)
-            self.logger.info(f"Inserting {operation_count} records into collection {collection.name}")
-
-            for n in range(1, operation_count + 1, run_batch_size):
-                tasks.clear()
-                inserted_count = 0
-                for key in range(n, n + run_batch_size):
-                    if key > operation_count:
-                        break
-                    document = rand.process_template()
-                    tasks.add(executor.submit(db_op.execute,
-                                              KeyFormat.key_format(key_format, document, db.collection_name, key + last_batch, schema.id_key),
-                                              document,
-                                              config.safe_mode))
-                    inserted_count += 1
-                results = self.task_wait(tasks)
-                inserted_total += len(results)
-                skipped_count = inserted_count - len(results)
+            checkpoint = Checkpoint(config.checkpoint_file, f"{bucket.name}.{scope.name}.{collection.name}.{schema_index}", config.skip_init)
+            start = checkpoint.start + 1
+            remaining = operation_count - checkpoint.start
+
+            if remaining <= 0:
+                self.logger.info(f"Collection {collection.name} already has {operation_count} records loaded")
+                last_batch += operation_count
+                continue
+            elif checkpoint.start:
+                self.logger.info(f"Resuming collection {collection.name} after record {checkpoint.start}")
+
+            self.logger.info(f"Inserting {remaining} records into collection {collection.name}")
+
+            keyspace = (bucket.name, scope.name, collection.name, collection.idkey)
+            key_info = (key_format, key_prefix, schema.id_key, last_batch)
+
+            if config.load_processes > 1:
+                loader = GeneratorPool(config.load_processes, run_batch_size, start_method=LOAD_START_METHOD)
+                settings = dict(config.settings(), ops_rate=config.ops_rate / config.load_processes)
+                extra = [(settings, keyspace, key_info, logging.getLogger().level)] * config.load_processes
+                for item in loader.run(load_range, schema.doc, start, remaining, extra):
+                    if item[0] == "complete":
+                        checkpoint.complete(item[1], item[2])
+                        continue
+                    inserted, submitted, range_stats, range_operations = item
+                    inserted_total += inserted
+                    submitted_total += submitted
+                    stats.merge(range_stats)
+                    merge_stats(range_operations)
+            else:
+                if config.generator_processes > 0:
+                    generator = GeneratorPool(config.generator_processes, run_batch_size, start_method=LOAD_START_METHOD)
+                    blocks = generator.blocks(schema.doc, start, remaining)
+                else:
+                    rand.set_unique_stream(rand.unique_key, start == 1)
+                    blocks = self.generate_blocks(start, remaining, run_batch_size)
+
+                with IntervalReporter(collection.name, [stats]):
+                    inserted, submitted = self.write(*keyspace, self.key_blocks(checkpoint.track(blocks), *key_info), stats, checkpoint=checkpoint)
+                inserted_total += inserted
+                submitted_total += submitted
+            checkpoint.save()
             last_batch += operation_count
 
-        self.logger.info(f"Inserted {inserted_total} skipped {skipped_count}")
+        stats.stop()
+        operation_stats("load").merge(stats)
+        self.logger.info(f"Inserted {inserted_total} skipped {submitted_total - inserted_total - stats.errors} errors {stats.errors}")
+        self.logger.info(f"{'Barrier' if config.barrier_mode else 'Pipeline'} write: {stats.summary()}")
+
+    @staticmethod
+    def generate_blocks(start: int, count: int, block_size: int):
+        for n in range(start, start + count, block_size):
+            yield n, rand.generate_batch(min(block_size, start + count - n), start=n)
+
+    @staticmethod
+    def key_blocks(blocks, key_format: KeyStyle, key_prefix: str, id_key: str, offset: int):
+        for n, documents in blocks:
+            yield [(KeyFormat.key_format(key_format, document, key_prefix, key + offset, id_key), document)
+                   for key, document in zip(it.count(n), documents)]
 
     def post_process(self, bucket: Bucket, scope: Scope, collection: Collection):
         pass
 
+    @staticmethod
+    def select_collection() -> tuple[Bucket, Scope, Collection]:
+        collections = [(b, s, c) for b in config.schema.buckets for s in b.scopes for c in s.collections]
+        for bucket, scope, collection in collections:
+            if scope.name == config.scope_name and collection.name == config.collection_name:
+                return bucket, scope, collection
+        return collections[0]
+
+    def kv_run(self):
+        workload = KVWorkload(*self.select_collection())
+        workload.run()
+        workload.report()
+
+    @staticmethod
+    def query_run():
+        workload = QueryWorkload(config.schema)
+        workload.run()
+        workload.report()
+
+    def calibrate(self):
+        bucket = config.schema.buckets[0]
+        scope = bucket.scopes[0]
+        collection = scope.collections[0]
+        schema = collection.schema[0] if type(collection.schema) == list else collection.schema
+        key_format = KeyStyle[collection.key_format.upper()] if collection.key_format else KeyStyle.DEFAULT
+        key_prefix = bucket.name if collection.name == "_default" else collection.name
+        keyspace = (bucket.name, scope.name, collection.name, collection.idkey)
+        key_info = (key_format, key_prefix, schema.id_key, 0)
+        warmup_time = config.ramp_step_time * 0.2
+        concurrency = max(1, config.run_threads)
+        max_concurrency = max(concurrency, config.max_threads)
+        unit = "writer threads" if config.sync_mode else f"in-flight batches of {config.write_batch} documents"
+        records = it.count(1, config.batch_size)
+        loop = None if config.sync_mode else asyncio.new_event_loop()
+        steps = []
+
+        def ramp_step(duration: float, stats: LatencyStats):
+            blocks = self.key_blocks(self.ramp_blocks(records, config.batch_size, duration), *key_info)
+            if loop:
+                return loop.run_until_complete(self.write_async(*keyspace, blocks, stats, concurrency))
+            return self.write_sync(*keyspace, blocks, stats, concurrency)
+
+        if not config.skip_init:
+            self.pre_process(bucket, scope, collection)
+        rand.prepare_template(schema.doc)
+        self.logger.info(f"Calibrating {collection.name} from {concurrency} to {max_concurrency} {unit}")
+
+        try:
+            while concurrency <= max_concurrency:
+                ramp_step(warmup_time, LatencyStats())
+                stats = LatencyStats()
+                ramp_step(config.ramp_step_time, stats)
+                stats.stop()
+                operation_stats(f"calibrate.{concurrency}").merge(stats)
+                steps.append((concurrency, stats))
+                self.logger.info(f"Concurrency {concurrency}: {stats.summary()}")
+
+                if config.latency_limit and stats.percentile(99) > config.latency_limit:
+                    self.logger.info(f"Stopping: p99 latency {stats.percentile(99):.3f} ms is over the {config.latency_limit} ms limit")
+                    break
+                if len(steps) > 1 and stats.ops_per_second < max(s.ops_per_second for c, s in steps[:-1]) * 1.05:
+                    self.logger.info("Stopping: throughput did not improve")
+                    break
+                concurrency *= 2
+        finally:
+            if loop:
+                loop.run_until_complete(connections.close_async())
+                loop.close()
+
+        if config.defer_index:
+            self.build_indexes([(bucket, scope, collection)])
+        print(f"{'Concurrency':>11} {'Ops/sec':>10} {'p50 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9}")
+        for step, stats in steps:
+            print(f"{step:>11} {stats.ops_per_second:>10.0f} {stats.percentile(50):>9.3f} {stats.percentile(99):>9.3f} {stats.percentile(99.9):>9.3f}")
+        print(f"Recommended concurrency: {self.recommend(steps)} {unit}")
+
+    @staticmethod
+    def recommend(steps: list) -> int:
+        eligible = [(c, s) for c, s in steps if not config.latency_limit or s.percentile(99) <= config.latency_limit] or steps[:1]
+        best = max(s.ops_per_second for c, s in eligible)
+        return min(c for c, s in eligible if s.ops_per_second >= best * 0.95)
+
+    @staticmethod
+    def ramp_blocks(records, block_size: int, duration: float):
+        end_time = time.perf_counter() + duration
+        while time.perf_counter() < end_time:
+            n = next(records)
+            yield n, rand.generate_batch(block_size, start=n)
+
+    def schema_generate(self):
+        processes = max(1, config.generator_processes)
+        run_batch_size = config.batch_size * 10
+        manifest = {"schema": config.schema_name, "collections": []}
+
+        try:
+            os.makedirs(config.output_dir, exist_ok=True)
+        except OSError as err:
+            raise TestRunError(f"can not create output directory {config.output_dir}: {err}")
+
+        for bucket in config.schema.buckets:
+            for scope in bucket.scopes:
+                for collection in scope.collections:
+                    entry = {
+                        "bucket": bucket.name,
+                        "scope": scope.name,
+                        "collection": collection.name,
+                        "key_prefix": bucket.name if collection.name == "_default" else collection.name,
+                        "key_format": collection.key_format,
+                        "idkey": collection.idkey,
+                        "documents": 0,
+                        "shards": []
+                    }
+                    schema_list = collection.schema if type(collection.schema) == list else [collection.schema]
+                    last_batch = 0
+
+                    for n, schema in enumerate(schema_list):
+                        operation_count = schema.record_count if schema.override_count else config.count
+                        prefix = os.path.join(config.output_dir, f"{bucket.name}.{scope.name}.{collection.name}.{n}")
+                        self.logger.info(f"Generating {operation_count} records for collection {collection.name}")
+                        begin_time = time.time()
+                        shards = GeneratorPool(processes, run_batch_size).write_shards(schema.doc, 1, operation_count, prefix, config.compress_output)
+                        total_time = time.time() - begin_time
+                        for shard in shards:
+                            shard.update({"start": shard["start"] + last_batch, "id_key": schema.id_key})
+                        entry["shards"].extend(shards)
+                        entry["documents"] += operation_count
+                        last_batch += operation_count
+                        self.logger.info(f"Generated {operation_count} records in {total_time:.2f} seconds ({operation_count / max(total_time, 1e-9):.0f} docs/sec)")
+
+                    manifest["collections"].append(entry)
+
+        manifest_file = os.path.join(config.output_dir, "manifest.json")
+        with open(manifest_file, 'w') as manifest_output:
+            json.dump(manifest, manifest_output, indent=2)
+        self.logger.info(f"Wrote manifest {manifest_file}")
+
+    def replay_load(self):
+        run_batch_size = config.batch_size * 10
+        manifest_file = os.path.join(config.replay_dir, "manifest.json")
+
+        try:
+            with open(manifest_file, 'r') as manifest_input:
+                manifest = json.load(manifest_input)
+        except (OSError, ValueError) as err:
+            raise TestRunError(f"can not read manifest {manifest_file}: {err}")
+
+        for entry in manifest["collections"]:
+            self.logger.info(f"Replaying {entry['documents']} records into collection {entry['collection']}")
+
+            try:
+                self.prep_bucket(entry["bucket"], entry["scope"], entry["collection"], config.bucket_quota)
+            except Exception as err:
+                raise TestRunError(f"can not connect to Couchbase: {err}")
+
+            if entry["key_format"]:
+                try:
+                    key_format = KeyStyle[entry["key_format"].upper()]
+                except KeyError:
+                    raise TestRunError(f"unknown key format: {entry['key_format']}")
+            else:
+                key_format = KeyStyle.DEFAULT
+
+            stats = LatencyStats()
+            items = self.replay_blocks(entry, key_format, run_batch_size)
+            with IntervalReporter(entry["collection"], [stats]):
+                inserted, submitted = self.write(entry["bucket"], entry["scope"], entry["collection"], entry["idkey"], items, stats)
+            stats.stop()
+            operation_stats("load").merge(stats)
+            self.logger.info(f"Inserted {inserted}: {stats.summary()}")
+
+    @staticmethod
+    def replay_blocks(entry: dict, key_format: KeyStyle, block_size: int):
+        for shard in entry["shards"]:
+            key_count = it.count(shard["start"])
+            for documents in read_shard(os.path.join(config.replay_dir, shard["file"]), block_size):
+                yield [(KeyFormat.key_format(key_format, document, entry["key_prefix"], key, shard["id_key"]), document)
+                       for key, document in zip(key_count, documents)]
+
     def run_link_rule(self, id_field: str, source_keyspace: str, target_keyspace: str):
         s_keyspace = '.'.join(source_keyspace.split(':')[:3])
         t_keyspace = '.'.join(target_keyspace.split(':')[:3])
         t_field = target_keyspace.split(':')[-1]
 
         try:
-            db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect()
+            db = connections.get(CBConnect)
         except Exception as err:
             raise TestRunError(f"can not connect to Couchbase: {err}")
 
@@ -221,7 +774,7 @@ class MainLoop(object):
 
     def run_sql_rule(self, query: str):
         try:
-            db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect()
+            db = connections.get(CBConnect)
         except Exception as err:
             raise TestRunError(f"can not connect to Couchbase: {err}")
 
@@ -230,18 +783,16 @@ class MainLoop(object):
         db_op.execute()
 
     def input_load(self):
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.batch_size)
-        decoder = json.JSONDecoder()
         bucket = config.bucket_name
         scope = config.scope_name
         collection = config.collection_name
-        tasks = set()
+        stats = LatencyStats()
 
         self.logger.info(f"Inserting records into collection {collection}")
 
         try:
             self.prep_bucket(bucket, scope, collection)
-            db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect(bucket, scope, collection)
+            db = connections.get(CBConnect, bucket, scope, collection)
         except Exception as err:
             raise TestRunError(f"can not connect to Couchbase: {err}")
 
@@ -252,30 +803,36 @@ class MainLoop(object):
 
         count = db.collection_count()
 
-        object_count = 0
-        key_count = count
+        with IntervalReporter(collection, [stats]):
+            inserted, object_count = self.write(bucket, scope, collection, "record_id", self.input_blocks(content, count), stats)
+        stats.stop()
+        operation_stats("load").merge(stats)
+
+        self.logger.info(f"Collection had {count} documents - inserted {inserted} additional record(s)")
+        if stats.errors:
+            raise TestRunError(f"{stats.errors} of {object_count} record(s) failed to write")
+
+    @staticmethod
+    def input_blocks(content, key_count: int):
+        decoder = json.JSONDecoder()
         buffer = ''
         for chunk in iter(partial(content.read, 131072), ''):
-            tasks.clear()
+            items = []
             buffer += chunk
             while buffer:
                 try:
                     json_object, position = decoder.raw_decode(buffer)
-                    db_op = DBWrite(db)
                     key_count += 1
                     if config.key_field in json_object:
                         doc_key = json_object[config.key_field]
                     else:
                         doc_key = key_count
-                    tasks.add(executor.submit(db_op.execute, doc_key, json_object))
-                    object_count += 1
+                    items.append((doc_key, json_object))
                     buffer = buffer[position:]
                     buffer = buffer.lstrip()
                 except ValueError:
                     break
-            self.task_wait(tasks)
-
-        self.logger.info(f"Collection had {count} documents - inserted {object_count} additional record(s)")
+            yield items
 
     def read(self):
         bucket = config.bucket_name
@@ -283,22 +840,26 @@ class MainLoop(object):
         collection = config.collection_name
 
         try:
-            db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect(bucket, scope, collection)
+            db = connections.get(CBConnect, bucket, scope, collection)
         except Exception as err:
             raise TestRunError(f"can not connect to Couchbase: {err}")
 
         if config.document_key:
             self.read_by_key(config.document_key, db)
-        else:
+        elif config.sync_mode:
             self.read_by_meta_id(db)
+        else:
+            self.read_by_meta_id_async(db, bucket, scope, collection)
 
     @staticmethod
     def read_by_key(key: str, db: CBConnect, start: int = 1):
         count = it.count(start)
         db_op = DBRead(db)
+        limiter = RateLimiter(config.ops_rate)
 
         while True:
             lookup_key, n = re.subn(r"%N", lambda x: str(next(count)), key)
+            limiter.wait()
             db_op.execute(lookup_key)
             if not db_op.result:
                 break
@@ -316,10 +877,30 @@ class MainLoop(object):
         query_op = DBQuery(db, query, keyspace=db.keyspace)
         query_op.execute()
         db_op = DBRead(db)
+        limiter = RateLimiter(config.ops_rate)
         for meta_id in query_op.result:
+            limiter.wait()
             db_op.execute(meta_id['id'])
             try:
                 output = json.dumps(db_op.result, indent=2)
             except json.decoder.JSONDecodeError:
                 output = db_op.result
             print(output)
+
+    def read_by_meta_id_async(self, db: CBConnect, bucket: str, scope: str, collection: str):
+        query = r"select meta().id from {{ keyspace }} ;"
+        query_op = DBQuery(db, query, keyspace=db.keyspace)
+        query_op.execute()
+        keys = [meta_id['id'] for meta_id in query_op.result]
+        stats = LatencyStats()
+        with IntervalReporter(collection, [stats]):
+            results = asyncio.run(self.fetch_async(bucket, scope, collection, keys, stats=stats))
+        for result in results:
+            try:
+                output = json.dumps(result, indent=2)
+            except json.decoder.JSONDecodeError:
+                output = result
+            print(output)
+        stats.stop()
+        operation_stats("read").merge(stats)
+        self.logger.info(f"Read: {stats.summary()}")
@@ -7,11 +7,11 @@ import time
 import concurrent.futures
 from lib.plugins.relational import Schema, Table
 from datetime import date, datetime
-from cbcmgr.cb_connect import CBConnect
+from lib.connect import CBConnectBatch, connections
 import lib.config as config
 from lib.exceptions import PluginImportError
 from lib.main import MainLoop
-from lib.exec_step import DBWrite
+from lib.exec_step import DBWrite, LatencyStats, timed_call
 
 
 class PluginImport(object):
@@ -40,6 +40,7 @@ class PluginImport(object):
 
     def import_tables(self):
         executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.batch_size)
+        window = max(1, config.batch_size * 10 // config.write_batch) - 1
         bucket = config.bucket_name
         scope = config.scope_name
         tasks = set()
@@ -75,28 +76,36 @@ class PluginImport(object):
                             self.logger.info(f"Index already exists")
                         else:
                             self.logger.info(f"Created index {index_name}")
-                db = CBConnect(config.host, config.username, config.password, ssl=config.tls).connect(bucket, scope, collection)
+                db = connections.get(CBConnectBatch, bucket, scope, collection)
             except Exception as err:
                 raise PluginImportError(f"can not connect to Couchbase: {err}")
 
             self.logger.info(f"Copying {table.rows:,} row(s) of table data to Couchbase (this step may take some time)")
             db_op = DBWrite(db)
+            stats = LatencyStats()
             key_count = 0
-            iteration_count = 0
+            inserted = 0
+            batch = []
             tasks.clear()
             for row in self.plugin.get_table(table):
                 row_json = json.dumps(row, indent=2, default=self.json_serial)
                 document = json.loads(row_json)
                 key_count += 1
-                tasks.add(executor.submit(db_op.execute, key_count, document))
-                iteration_count += 1
-                if iteration_count >= config.batch_size:
-                    MainLoop().task_wait(tasks)
-                    tasks.clear()
-                    iteration_count = 0
-
-            MainLoop().task_wait(tasks)
+                batch.append((key_count, document))
+                if len(batch) >= config.write_batch:
+                    inserted += MainLoop().task_drain(tasks, stats, window)
+                    tasks.add(executor.submit(timed_call, db_op.execute_many, batch))
+                    batch = []
+
+            if batch:
+                tasks.add(executor.submit(timed_call, db_op.execute_many, batch))
+            inserted += MainLoop().task_drain(tasks, stats)
             tasks.clear()
+            stats.stop()
+            self.logger.debug(f"Table write: {stats.summary()}")
+            self.logger.info(f"Wrote {inserted:,} of {key_count:,} row(s)")
+            if stats.errors:
+                raise PluginImportError(f"{stats.errors:,} row(s) of table {table.name} failed to write")
 
             if table.rows != key_count:
                 self.logger.warning(f"Actual rows {key_count} doesn't equal expected count {table.rows}")
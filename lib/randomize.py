@@ -2,21 +2,24 @@
 ##
 
 import os
+import logging
 import warnings
 import json
-import multiprocessing
+import zlib
+import itertools
+import concurrent.futures
 import random
 import re
 import io
-from jinja2 import Template
-from jinja2.environment import Environment
-from jinja2.runtime import DebugUndefined
-from jinja2.meta import find_undeclared_variables
 from datetime import datetime, timedelta
-from lib.exceptions import ConfigFileError
+from lib.exceptions import ConfigFileError, SchemaFileError
+from lib.distribution import distributions, distribution_args, get_distribution
+from lib.template import DocTemplate, TokenValues
+from lib.datastore import DataStore, DataList
 import base64
 import hashlib
 from enum import Enum
+from typing import Union
 import numpy
 from PIL import Image
 
@@ -43,80 +46,92 @@ class Region(Enum):
     west = 2
 
 
-class FastRandom(object):
-
-    def __init__(self, x=256, start=1):
-        self.max_value = x
-        self.bits = self.max_value.bit_length()
-        self.start_value = start
-
-    @property
-    def value(self):
-        rand_number = random.getrandbits(self.bits) % self.max_value
-        if rand_number < self.start_value:
-            rand_number = self.start_value
-        if rand_number > self.max_value:
-            rand_number = self.max_value
-        return rand_number
-
-
-class MPAtomicIncrement(object):
-
-    def __init__(self, i=1, s=1):
-        self.count = multiprocessing.Value('i', i)
-        self._set_size = s
-        self.set_count = multiprocessing.Value('i', s)
-
-    def reset(self, i=1):
-        with self.count.get_lock():
-            self.count.value = i
-
-    def set_size(self, n):
-        self._set_size = n
-        with self.set_count.get_lock():
-            self.set_count.value = self._set_size
-
-    @property
-    def do_increment(self):
-        with self.set_count.get_lock():
-            if self.set_count.value == 1:
-                self.set_count.value = self._set_size
-                return True
-            else:
-                self.set_count.value -= 1
-                return False
-
-    @property
-    def next(self):
-        if self.do_increment:
-            with self.count.get_lock():
-                current = self.count.value
-                self.count.value += 1
-            return current
-        else:
-            return self.count.value
+class DigitDomain(object):
+
+    def __init__(self, width: int):
+        self.width = width
+        self.count = 10 ** width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int):
+        return f"{index:0{self.width}d}"
+
+    def take(self, indices: list[int]) -> list[str]:
+        return [f"{i:0{self.width}d}" for i in indices]
 
 
 data_file_name = package_dir + '/config/data.json'
+store_file_name = package_dir + '/config/data.bin'
 data_struct = {}
 issued_struct = {
-    "ssn": {},
     "username": {},
     "email": {},
     "nickname": {}
 }
+ssn_space = 1000000000
+ssn_sequence = itertools.count(1)
+name_sequence = itertools.count(1)
+unique_key = random.getrandbits(64)
+unique_plain = True
+template_key = 0
 requested_tags = None
 template = None
-compiled: Template
+compiled: DocTemplate
 password_hash = HashMode.sha1.value
-incrementor = MPAtomicIncrement()
-incrementor_block = MPAtomicIncrement(s=10)
-region_block = MPAtomicIncrement(i=0, s=10)
+record_number = 1
+image_pool = []
+image_pool_size = 64
+image_width = 128
+image_height = 128
+image_format = "JPEG2000"
+image_cache_dir = None
+image_processes = 0
+generator = numpy.random.default_rng()
+digit_table = bytes(ord('0') + b % 10 for b in range(256))
+lower_table = bytes(ord('a') + b % 26 for b in range(256))
+upper_table = bytes(ord('A') + b % 26 for b in range(256))
+hash_table = bytes(ord('0') + b % 10 if b < 85 else ord('A') + b % 26 if b < 170 else ord('a') + b % 26 for b in range(256))
+month_abbr = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def seed_generators(seed: numpy.random.SeedSequence) -> None:
+    global generator
+    generator = numpy.random.default_rng(seed)
+    random.seed(int(seed.generate_state(1, dtype=numpy.uint64)[0]))
+
+
+def set_unique_stream(key: int, plain: bool = True) -> None:
+    global unique_key, unique_plain
+    unique_key = key
+    unique_plain = plain
+
+
+def set_record(n: int) -> None:
+    global record_number
+    record_number = n
+
+
+def next_record():
+    global record_number
+    current = record_number
+    record_number += 1
+    return current
 
 
 def load_data() -> None:
     global data_struct
 
+    if data_struct:
+        return
+
+    if os.path.exists(store_file_name):
+        if not os.path.exists(data_file_name) or os.path.getmtime(store_file_name) >= os.path.getmtime(data_file_name):
+            data_struct = DataStore(store_file_name)
+            return
+        logging.getLogger(__name__).warning(f"{data_file_name} is newer than {store_file_name}, using the JSON data (rerun config/generate.py to rebuild the store)")
+
     try:
         with open(data_file_name, 'r') as data_file:
             data_struct = json.load(data_file)
@@ -125,12 +140,11 @@ def load_data() -> None:
 
 
 def random_number_seq(n):
-    min_lc = ord(b'0')
-    len_lc = 10
-    ba = bytearray(random.getrandbits(8) for i in range(n))
-    for i, b in enumerate(ba):
-        ba[i] = min_lc + b % len_lc
-    return ba.decode('utf-8')
+    return random.randbytes(n).translate(digit_table).decode('utf-8')
+
+
+def random_index(n: int) -> int:
+    return random.getrandbits(n.bit_length()) % n
 
 
 def random_match(match: re.Match):
@@ -142,12 +156,7 @@ def random_match(match: re.Match):
 
 def random_number(n, m=0):
     while True:
-        min_lc = ord(b'0')
-        len_lc = 10
-        ba = bytearray(random.getrandbits(8) for i in range(n))
-        for i, b in enumerate(ba):
-            ba[i] = min_lc + b % len_lc
-        v = int(ba.decode('utf-8'))
+        v = int(random_number_seq(n))
         if v < m:
             continue
         return str(v)
@@ -162,30 +171,15 @@ def random_number_range(minimum, maximum):
 
 
 def random_string_lower(n):
-    min_lc = ord(b'a')
-    len_lc = 26
-    ba = bytearray(random.getrandbits(8) for i in range(n))
-    for i, b in enumerate(ba):
-        ba[i] = min_lc + b % len_lc
-    return ba.decode('utf-8')
+    return random.randbytes(n).translate(lower_table).decode('utf-8')
 
 
 def random_string_upper(n):
-    min_lc = ord(b'A')
-    len_lc = 26
-    ba = bytearray(random.getrandbits(8) for i in range(n))
-    for i, b in enumerate(ba):
-        ba[i] = min_lc + b % len_lc
-    return ba.decode('utf-8')
+    return random.randbytes(n).translate(upper_table).decode('utf-8')
 
 
 def random_hash(n):
-    ba = bytearray(random.getrandbits(8) for i in range(n))
-    for i, b in enumerate(ba):
-        min_lc = ord(b'0') if b < 85 else ord(b'A') if b < 170 else ord(b'a')
-        len_lc = 10 if b < 85 else 26
-        ba[i] = min_lc + b % len_lc
-    return ba.decode('utf-8')
+    return random.randbytes(n).translate(hash_table).decode('utf-8')
 
 
 def random_bits(n, m=0):
@@ -218,17 +212,47 @@ def credit_card():
     data = data_struct.get('card_masks')
     if not data:
         raise ConfigFileError("No credit card mask data")
-    rand_gen = FastRandom(len(data), 0)
-    card_mask = data[rand_gen.value]
+    card_mask = data[random_index(len(data))]
     return re.sub('X', random_match, card_mask)
 
 
-def social_security_number():
-    while True:
-        issued = '-'.join([random_number_seq(3), random_number_seq(2), random_number_seq(4)])
-        if not issued_struct['ssn'].get(issued):
-            issued_struct['ssn'].update({issued: None})
-            return issued
+def round_keys() -> list[int]:
+    key = (unique_key + template_key) & 0xFFFFFFFFFFFFFFFF
+    return [(key >> (16 * r)) & 0xFFFF for r in range(4)]
+
+
+def feistel(x, keys: list[int]):
+    left = x >> 15
+    right = x & 0x7FFF
+    for k in keys:
+        left, right = right, left ^ ((((right ^ k) * 0x9E3779B1) >> 13) & 0x7FFF)
+    return (left << 15) | right
+
+
+def permute_index(n: int) -> int:
+    keys = round_keys()
+    x = feistel((n - 1) % ssn_space, keys)
+    while x >= ssn_space:
+        x = feistel(x, keys)
+    return x
+
+
+def format_ssn(x: int) -> str:
+    return f"{x // 1000000:03}-{x // 10000 % 100:02}-{x % 10000:04}"
+
+
+def social_security_number(n: Union[int, None] = None):
+    if n is None:
+        n = next(ssn_sequence)
+    return format_ssn(permute_index(n))
+
+
+def unique_name(kind: str, name: str, record: int) -> str:
+    issued = issued_struct[kind]
+    if unique_plain and name not in issued:
+        issued[name] = record
+        return name
+    return name + str(record)
 
 
 def three_digits():
@@ -323,16 +347,14 @@ def rand_street_name():
     data = data_struct.get('street_names')
     if not data:
         raise ConfigFileError("No random street name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_street_suffix():
     data = data_struct.get('street_suffix')
     if not data:
         raise ConfigFileError("No random street suffix data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_first_name(g: Gender):
@@ -342,48 +364,42 @@ def rand_first_name(g: Gender):
         data = data_struct.get('first_names', {}).get('female')
     if not data:
         raise ConfigFileError("No random first name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_last_name():
     data = data_struct.get('last_names')
     if not data:
         raise ConfigFileError("No random last name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_city():
     data = data_struct.get('city_names')
     if not data:
         raise ConfigFileError("No random city name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_state():
     data = data_struct.get('state_names_short')
     if not data:
         raise ConfigFileError("No random state name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_franchise():
     data = data_struct.get('franchises')
     if not data:
         raise ConfigFileError("No random franchise name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def rand_corporation():
     data = data_struct.get('corporations')
     if not data:
         raise ConfigFileError("No random corporation name data")
-    rand_gen = FastRandom(len(data), 0)
-    return data[rand_gen.value]
+    return data[random_index(len(data))]
 
 
 def address_line():
@@ -394,8 +410,7 @@ def phone_number():
     data = data_struct.get('area_codes')
     if not data:
         raise ConfigFileError("No random street suffix data")
-    rand_gen = FastRandom(len(data), 0)
-    area_code = data[rand_gen.value]
+    area_code = data[random_index(len(data))]
     nxx = re.sub('N', random_match, 'NXX')
     nxx = re.sub('X', random_match, nxx)
     return '-'.join([area_code, nxx, random_number_seq(4)])
@@ -417,44 +432,224 @@ def date_iso_30():
     return _past_date.isoformat()
 
 
-def nick_name(first_name="John", last_name="Doe"):
-    name = first_name[0].lower() + last_name.lower()
-    found = [issued_struct['nickname'][key] for key in issued_struct['nickname'] if re.match(f"^{name}", key)]
-    if len(found) > 0:
-        suffix = str(len(found))
-        name += suffix
-    return name
+def nick_name(first_name="John", last_name="Doe", record: Union[int, None] = None):
+    return unique_name('nickname', first_name[0].lower() + last_name.lower(), next(name_sequence) if record is None else record)
 
 
-def email_address(first_name="John", last_name="Doe"):
-    mailbox = first_name.lower() + '.' + last_name.lower()
-    found = [issued_struct['email'][key] for key in issued_struct['email'] if re.match(f"^{mailbox}", key)]
-    if len(found) > 0:
-        suffix = str(len(found))
-        mailbox += suffix
-    return mailbox + '@example.com'
+def email_address(first_name="John", last_name="Doe", record: Union[int, None] = None):
+    return unique_name('email', first_name.lower() + '.' + last_name.lower(), next(name_sequence) if record is None else record) + '@example.com'
 
 
-def user_name(first_name="John", last_name="Doe"):
-    user = first_name.lower() + last_name.lower()
-    found = [issued_struct['username'][key] for key in issued_struct['username'] if re.match(f"^{user}", key)]
-    if len(found) > 0:
-        suffix = str(len(found))
-        user += suffix
-    return user
+def user_name(first_name="John", last_name="Doe", record: Union[int, None] = None):
+    return unique_name('username', first_name.lower() + last_name.lower(), next(name_sequence) if record is None else record)
 
 
-def rand_image():
-    random_matrix = numpy.random.rand(128, 128, 3) * 255
-    im = Image.fromarray(random_matrix.astype('uint8')).convert('RGBA')
+def encode_image(width: int, height: int, fmt: str, seed: int) -> str:
+    random_matrix = numpy.random.default_rng(seed).random((height, width, 3)) * 255
+    im = Image.fromarray(random_matrix.astype('uint8')).convert('RGB' if fmt.upper() == 'JPEG' else 'RGBA')
     with io.BytesIO() as output:
-        im.save(output, format="JPEG2000")
+        try:
+            im.save(output, format=fmt)
+        except (KeyError, OSError) as err:
+            raise ConfigFileError(f"can not encode {fmt} image: {err}")
         contents = output.getvalue()
     encoded = base64.b64encode(contents)
     encoded = encoded.decode('utf-8')
     return encoded
 
 
+def set_image_pool(size: int = 64, width: int = 128, height: int = 128, fmt: str = "JPEG2000", cache_dir: Union[str, None] = None, processes: int = 0):
+    global image_pool, image_pool_size, image_width, image_height, image_format, image_cache_dir, image_processes
+    if (size, width, height, fmt) != (image_pool_size, image_width, image_height, image_format):
+        image_pool = []
+    image_pool_size = size
+    image_width = width
+    image_height = height
+    image_format = fmt
+    image_cache_dir = cache_dir
+    image_processes = processes
+
+
+def image_cache_file() -> Union[str, None]:
+    if not image_cache_dir:
+        return None
+    return os.path.join(image_cache_dir, f"image_pool_{image_format.lower()}_{image_width}x{image_height}_{image_pool_size}.dat")
+
+
+def load_image_pool() -> list[str]:
+    global image_pool
+    if image_pool:
+        return image_pool
+
+    cache_file = image_cache_file()
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, 'r') as pool_file:
+            images = pool_file.read().split()
+        if len(images) == image_pool_size:
+            image_pool = images
+            return image_pool
+
+    count = image_pool_size
+    seeds = generator.integers(0, 1 << 62, size=count).tolist()
+    if image_processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=image_processes) as executor:
+            images = list(executor.map(encode_image, [image_width] * count, [image_height] * count, [image_format] * count, seeds))
+    else:
+        images = [encode_image(image_width, image_height, image_format, seed) for seed in seeds]
+
+    if cache_file:
+        try:
+            os.makedirs(image_cache_dir, exist_ok=True)
+            with open(cache_file + '.tmp', 'w') as pool_file:
+                pool_file.write('\n'.join(images))
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError:
+            pass
+
+    image_pool = images
+    return image_pool
+
+
+def rand_image():
+    pool = load_image_pool()
+    return pool[random_index(len(pool))]
+
+
+def batch_bytes(n, width):
+    return generator.integers(0, 256, size=(n, width), dtype=numpy.uint8)
+
+
+def batch_digits(n, width):
+    digits = numpy.frombuffer(digit_table, dtype=numpy.uint8)[batch_bytes(n, width)]
+    return digits.view(f"S{width}").ravel().astype(f"U{width}")
+
+
+def batch_number(n, width, m=0, lengths=None):
+    if lengths is None:
+        lengths = numpy.full(n, width)
+    places = numpy.arange(width)
+    values = numpy.zeros(n, dtype=numpy.int64)
+    pending = numpy.arange(n)
+    while pending.size:
+        digits = (batch_bytes(pending.size, width) % 10).astype(numpy.int64)
+        length = lengths[pending][:, None]
+        exponent = numpy.clip(length - 1 - places, 0, None)
+        value = numpy.where(places < length, digits * 10 ** exponent, 0).sum(axis=1)
+        accepted = value >= m
+        values[pending[accepted]] = value[accepted]
+        pending = pending[~accepted]
+    return values
+
+
+def batch_choice(data: list, n):
+    bits = len(data).bit_length()
+    index = (generator.integers(0, 1 << bits, size=n) % len(data)).tolist()
+    if isinstance(data, DataList):
+        return data.take(index)
+    return [data[i] for i in index]
+
+
+def batch_dictionary(key: str, n):
+    data = data_struct.get(key)
+    if not data:
+        raise ConfigFileError(f"No random {key} data")
+    return batch_choice(data, n)
+
+
+def batch_record(n, columns):
+    global record_number
+    records = numpy.arange(record_number, record_number + n)
+    record_number += n
+    return records
+
+
+def batch_ssn(n, columns):
+    keys = round_keys()
+    values = feistel((columns['_record'].astype(numpy.int64) - 1) % ssn_space, keys)
+    pending = values >= ssn_space
+    while pending.any():
+        values[pending] = feistel(values[pending], keys)
+        pending = values >= ssn_space
+    return [format_ssn(x) for x in values.tolist()]
+
+
+def batch_credit_card(n, columns):
+    masks = [m.replace('X', '{}') for m in batch_dictionary('card_masks', n)]
+    digits = batch_digits(n, max(m.count('X') for m in data_struct.get('card_masks'))).tolist()
+    return [mask.format(*d) for mask, d in zip(masks, digits)]
+
+
+def batch_dollar(n, columns):
+    lengths = batch_bytes(n, 1).ravel() % 5 + 1
+    values = batch_number(n, 5, m=1, lengths=lengths).tolist()
+    cents = batch_digits(n, 2).tolist()
+    return [f"{v}.{c}" for v, c in zip(values, cents)]
+
+
+def batch_hash(n, columns):
+    chars = numpy.frombuffer(hash_table, dtype=numpy.uint8)[batch_bytes(n, 16)]
+    return chars.view("S16").ravel().astype("U16")
+
+
+def batch_address(n, columns):
+    numbers = batch_number(n, 4, m=1).tolist()
+    streets = batch_dictionary('street_names', n)
+    suffixes = batch_dictionary('street_suffix', n)
+    return [f"{a} {b} {c}" for a, b, c in zip(numbers, streets, suffixes)]
+
+
+def batch_phone(n, columns):
+    area_codes = batch_dictionary('area_codes', n)
+    exchange = batch_number(n, 1, m=2).tolist()
+    digits = batch_digits(n, 6).tolist()
+    return [f"{a}-{e}{d[:2]}-{d[2:]}" for a, e, d in zip(area_codes, exchange, digits)]
+
+
+def batch_gender(n, columns):
+    genders = (Gender.M, Gender.F)
+    return [genders[b] for b in generator.integers(0, 2, size=n).tolist()]
+
+
+def batch_first_name(n, columns):
+    names = data_struct.get('first_names', {})
+    if not names.get('male') or not names.get('female'):
+        raise ConfigFileError("No random first name data")
+    male = batch_choice(names.get('male'), n)
+    female = batch_choice(names.get('female'), n)
+    return [m if g == Gender.M else f for g, m, f in zip(columns['_gender'], male, female)]
+
+
+def batch_year(n, columns):
+    return (batch_number(n, 2) + 1920).astype("U4")
+
+
+def batch_month(n, columns):
+    return generator.integers(1, 13, size=n).astype("U2")
+
+
+def batch_day(n, columns):
+    month = columns['rand_month'].astype(int)
+    last_day = numpy.where(numpy.isin(month, [1, 3, 5, 7, 8, 10, 12]), 31, numpy.where(numpy.isin(month, [4, 6, 9, 11]), 30, 28))
+    return numpy.char.zfill(generator.integers(1, last_day + 1).astype("U2"), 2)
+
+
+def batch_date(n, offset, bits):
+    today = numpy.datetime64(datetime.today().date(), 'D')
+    return (today - (generator.integers(0, 1 << bits, size=n) + offset).astype('timedelta64[D]')).astype("U10")
+
+
+def batch_date_slash(column):
+    return [f"{d[5:7]}/{d[8:10]}/{d[:4]}" for d in column.tolist()]
+
+
+def batch_date_hyphen(column):
+    return [f"{d[5:7]}-{d[8:10]}-{d[:4]}" for d in column.tolist()]
+
+
+def batch_date_text(column):
+    return [f"{month_abbr[int(d[5:7]) - 1]} {d[8:10]} {d[:4]}" for d in column.tolist()]
+
+
 def rand_password():
     password = "password"
     if password_hash == HashMode.sha1.value:
@@ -468,74 +663,228 @@ def rand_password():
     return base64.b64encode(digest).decode('utf-8')
 
 
+token_table = {
+    "_gender": (lambda v: rand_gender(), ()),
+    "_past_date": (lambda v: past_date(), ()),
+    "_dob_date": (lambda v: dob_date(), ()),
+    "date_time": (lambda v: date_code(), ()),
+    "_record": (lambda v: next_record(), ()),
+    "incr_value": (lambda v: v["_record"], ("_record",)),
+    "incr_block": (lambda v: (v["_record"] - 1) // 10 + 1, ("_record",)),
+    "region_name": (lambda v: Region((v["_record"] - 1) // 10 % 3).name, ("_record",)),
+    "rand_credit_card": (lambda v: credit_card(), ()),
+    "rand_ssn": (lambda v: social_security_number(v["_record"]), ("_record",)),
+    "rand_four": (lambda v: four_digits(), ()),
+    "rand_account": (lambda v: account_number(), ()),
+    "rand_id": (lambda v: numeric_sequence(), ()),
+    "rand_zip_code": (lambda v: zip_code(), ()),
+    "rand_dollar": (lambda v: dollar_amount(), ()),
+    "rand_hash": (lambda v: hash_code(), ()),
+    "rand_address": (lambda v: address_line(), ()),
+    "rand_city": (lambda v: rand_city(), ()),
+    "rand_state": (lambda v: rand_state(), ()),
+    "rand_first": (lambda v: rand_first_name(v["_gender"]), ("_gender",)),
+    "rand_last": (lambda v: rand_last_name(), ()),
+    "rand_nickname": (lambda v: nick_name(v["rand_first"], v["rand_last"], v["_record"]), ("rand_first", "rand_last", "_record")),
+    "rand_email": (lambda v: email_address(v["rand_first"], v["rand_last"], v["_record"]), ("rand_first", "rand_last", "_record")),
+    "rand_username": (lambda v: user_name(v["rand_first"], v["rand_last"], v["_record"]), ("rand_first", "rand_last", "_record")),
+    "rand_phone": (lambda v: phone_number(), ()),
+    "rand_bool": (lambda v: boolean_value(), ()),
+    "rand_year": (lambda v: year_value(), ()),
+    "rand_month": (lambda v: month_number(), ()),
+    "rand_day": (lambda v: day_value(v["rand_month"]), ("rand_month",)),
+    "rand_franchise": (lambda v: rand_franchise(), ()),
+    "rand_corporation": (lambda v: rand_corporation(), ()),
+    "date_iso_week": (lambda v: date_iso_7(), ()),
+    "date_iso_month": (lambda v: date_iso_30(), ()),
+    "rand_date_1": (lambda v: past_date_slash(v["_past_date"]), ("_past_date",)),
+    "rand_date_2": (lambda v: past_date_hyphen(v["_past_date"]), ("_past_date",)),
+    "rand_date_3": (lambda v: past_date_text(v["_past_date"]), ("_past_date",)),
+    "rand_dob_1": (lambda v: dob_slash(v["_dob_date"]), ("_dob_date",)),
+    "rand_dob_2": (lambda v: dob_hyphen(v["_dob_date"]), ("_dob_date",)),
+    "rand_dob_3": (lambda v: dob_text(v["_dob_date"]), ("_dob_date",)),
+    "rand_image": (lambda v: rand_image(), ()),
+    "rand_password": (lambda v: rand_password(), ()),
+}
+batch_table = {
+    "_record": batch_record,
+    "incr_value": lambda n, c: c['_record'],
+    "incr_block": lambda n, c: (c['_record'] - 1) // 10 + 1,
+    "region_name": lambda n, c: [Region(r).name for r in ((c['_record'] - 1) // 10 % 3).tolist()],
+    "_gender": batch_gender,
+    "_past_date": lambda n, c: batch_date(n, 0, 12),
+    "_dob_date": lambda n, c: batch_date(n, 7280, 14),
+    "rand_credit_card": batch_credit_card,
+    "rand_ssn": batch_ssn,
+    "rand_four": lambda n, c: batch_digits(n, 4),
+    "rand_account": lambda n, c: batch_digits(n, 10),
+    "rand_id": lambda n, c: batch_digits(n, 16),
+    "rand_zip_code": lambda n, c: batch_digits(n, 5),
+    "rand_dollar": batch_dollar,
+    "rand_hash": batch_hash,
+    "rand_address": batch_address,
+    "rand_city": lambda n, c: batch_dictionary('city_names', n),
+    "rand_state": lambda n, c: batch_dictionary('state_names_short', n),
+    "rand_first": batch_first_name,
+    "rand_last": lambda n, c: batch_dictionary('last_names', n),
+    "rand_phone": batch_phone,
+    "rand_bool": lambda n, c: generator.integers(0, 2, size=n).astype(bool),
+    "rand_year": batch_year,
+    "rand_month": batch_month,
+    "rand_day": batch_day,
+    "rand_franchise": lambda n, c: batch_dictionary('franchises', n),
+    "rand_corporation": lambda n, c: batch_dictionary('corporations', n),
+    "rand_date_1": lambda n, c: batch_date_slash(c['_past_date']),
+    "rand_date_2": lambda n, c: batch_date_hyphen(c['_past_date']),
+    "rand_date_3": lambda n, c: batch_date_text(c['_past_date']),
+    "rand_dob_1": lambda n, c: batch_date_slash(c['_dob_date']),
+    "rand_dob_2": lambda n, c: batch_date_hyphen(c['_dob_date']),
+    "rand_dob_3": lambda n, c: batch_date_text(c['_dob_date']),
+    "rand_image": lambda n, c: batch_choice(load_image_pool(), n),
+    "rand_password": lambda n, c: [rand_password()] * n,
+}
+domain_table = {
+    "rand_city": ((), lambda v: data_struct.get('city_names')),
+    "rand_state": ((), lambda v: data_struct.get('state_names_short')),
+    "rand_last": ((), lambda v: data_struct.get('last_names')),
+    "rand_first": (("_gender",), lambda v: data_struct.get('first_names', {}).get('male' if v["_gender"] == Gender.M else 'female')),
+    "rand_franchise": ((), lambda v: data_struct.get('franchises')),
+    "rand_corporation": ((), lambda v: data_struct.get('corporations')),
+    "rand_four": ((), lambda v: DigitDomain(4)),
+    "rand_zip_code": ((), lambda v: DigitDomain(5)),
+    "rand_account": ((), lambda v: DigitDomain(10)),
+    "rand_id": ((), lambda v: DigitDomain(16)),
+}
+resolve_plan = []
+batch_plan = []
+row_plan = []
+
+
+def parse_filter(tag: str) -> tuple[str, str, tuple]:
+    name, expression = tag.split('|', 1)
+    filter_name, args = expression.rstrip(')').split('(', 1)
+    try:
+        values = tuple(float(a) for a in args.split(',') if a)
+    except ValueError:
+        raise SchemaFileError(f"token {name}: invalid arguments for distribution {filter_name}: {args}")
+    expected = distribution_args[filter_name]
+    if len(values) > len(expected):
+        raise SchemaFileError(f"token {name}: distribution {filter_name} takes at most {len(expected)} arguments: {args}")
+    for (arg_name, check), value in zip(expected, values):
+        if not check(value):
+            raise SchemaFileError(f"token {name}: distribution {filter_name} argument {arg_name} out of range: {value:g}")
+    return name, filter_name, values
+
+
+def register_filter(tag: str) -> None:
+    name, filter_name, args = parse_filter(tag)
+    if name not in domain_table:
+        raise SchemaFileError(f"token {name} does not support distribution {filter_name}")
+    depends, domain = domain_table[name]
+    if filter_name == "latest":
+        depends = depends + ("_record",)
+
+    def sample(v):
+        data = domain(v)
+        if not data:
+            raise ConfigFileError(f"No random data for {name}")
+        return data[get_distribution(filter_name, len(data), args).index(v.get("_record", 1) - 1)]
+
+    token_table[tag] = (sample, depends)
+
+    if not depends or depends == ("_record",):
+        def batch_sample(n, columns):
+            data = domain({})
+            if not data:
+                raise ConfigFileError(f"No random data for {name}")
+            heads = columns['_record'] - 1 if '_record' in columns else None
+            index = get_distribution(filter_name, len(data), args).indices(n, generator, heads)
+            return data.take(index) if hasattr(data, 'take') else [data[i] for i in index]
+
+        batch_table[tag] = batch_sample
+
+
+def resolve_tokens(tags) -> list:
+    plan = []
+    visited = set()
+
+    def visit(name):
+        if '|' in name and name not in token_table:
+            register_filter(name)
+        if name in visited or name not in token_table:
+            return
+        visited.add(name)
+        func, depends = token_table[name]
+        for dependency in depends:
+            visit(dependency)
+        plan.append((name, func))
+
+    for tag in sorted(tags):
+        visit(tag)
+    return plan
+
+
+def split_plan(plan: list) -> tuple[list, list]:
+    columnar = set()
+    by_column = []
+    by_row = []
+    for name, func in plan:
+        if name in batch_table and all(d in columnar for d in token_table[name][1]):
+            columnar.add(name)
+            by_column.append((name, batch_table[name]))
+        else:
+            by_row.append((name, func))
+    return by_column, by_row
+
+
 def rand_init():
     load_data()
 
 
 def prepare_template(json_block):
-    global requested_tags, template, compiled, incrementor
-    incrementor.reset()
-    block_string = json.dumps(json_block)
-    env = Environment(undefined=DebugUndefined)
-    t = env.from_string(block_string)
-    rendered = t.render()
-    ast = env.parse(rendered)
-    requested_tags = find_undeclared_variables(ast)
-    template = block_string
-    compiled = Template(template)
+    global requested_tags, template, compiled, resolve_plan, batch_plan, row_plan, template_key
+    set_record(1)
+    template_key = zlib.crc32(json.dumps(json_block, sort_keys=True).encode('utf-8'))
+    template = json_block
+    compiled = DocTemplate(json_block, frozenset(distributions))
+    requested_tags = compiled.tokens
+    resolve_plan = resolve_tokens(requested_tags)
+    batch_plan, row_plan = split_plan(resolve_plan)
 
 
 def process_template():
-    global compiled
-    g = rand_gender()
-    first_name = rand_first_name(g)
-    last_name = rand_last_name()
-    _past_date = past_date()
-    _dob_date = dob_date()
-    month = month_number()
-    random_image = None
-
-    if 'rand_image' in requested_tags:
-        random_image = rand_image()
-
-    formatted_block = compiled.render(date_time=date_code(),
-                                      incr_value=incrementor.next,
-                                      incr_block=incrementor_block.next,
-                                      region_name=Region(region_block.next % 3).name,
-                                      rand_credit_card=credit_card(),
-                                      rand_ssn=social_security_number(),
-                                      rand_four=four_digits(),
-                                      rand_account=account_number(),
-                                      rand_id=numeric_sequence(),
-                                      rand_zip_code=zip_code(),
-                                      rand_dollar=dollar_amount(),
-                                      rand_hash=hash_code(),
-                                      rand_address=address_line(),
-                                      rand_city=rand_city(),
-                                      rand_state=rand_state(),
-                                      rand_first=first_name,
-                                      rand_last=last_name,
-                                      rand_nickname=nick_name(first_name, last_name),
-                                      rand_email=email_address(first_name, last_name),
-                                      rand_username=user_name(first_name, last_name),
-                                      rand_phone=phone_number(),
-                                      rand_bool=boolean_value(),
-                                      rand_year=year_value(),
-                                      rand_month=month,
-                                      rand_day=day_value(month),
-                                      rand_franchise=rand_franchise(),
-                                      rand_corporation=rand_corporation(),
-                                      date_iso_week=date_iso_7(),
-                                      date_iso_month=date_iso_30(),
-                                      rand_date_1=past_date_slash(_past_date),
-                                      rand_date_2=past_date_hyphen(_past_date),
-                                      rand_date_3=past_date_text(_past_date),
-                                      rand_dob_1=dob_slash(_dob_date),
-                                      rand_dob_2=dob_hyphen(_dob_date),
-                                      rand_dob_3=dob_text(_dob_date),
-                                      rand_image=random_image,
-                                      rand_password=rand_password(),
-                                      )
-    finished = formatted_block.encode('ascii')
-    json_block = json.loads(finished)
-    return json_block
+    values = TokenValues()
+    for name, func in resolve_plan:
+        values[name] = func(values)
+    return compiled.render(values)
+
+
+class ParameterTemplate(object):
+
+    def __init__(self, block: dict):
+        self.compiled = DocTemplate(block, frozenset(distributions), typed=True)
+        self.plan = resolve_tokens(self.compiled.tokens)
+
+    def render(self) -> dict:
+        values = TokenValues()
+        for name, func in self.plan:
+            values[name] = func(values)
+        return self.compiled.render(values)
+
+
+def generate_batch(n: int, start: Union[int, None] = None) -> list[dict]:
+    if start is not None:
+        set_record(start)
+    columns = {}
+    for name, func in batch_plan:
+        columns[name] = func(n, columns)
+    names = list(columns.keys())
+    data = [c.tolist() if isinstance(c, numpy.ndarray) else c for c in columns.values()]
+    rows = zip(*data) if data else [()] * n
+    documents = []
+    for row in rows:
+        values = TokenValues(zip(names, row))
+        for name, func in row_plan:
+            values[name] = func(values)
+        documents.append(compiled.render(values))
+    return documents
@@ -0,0 +1,38 @@
+##
+##
+
+import time
+import asyncio
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate: float = 0, clock=time.perf_counter, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_time = None
+
+    def reserve(self, count: int = 1) -> float:
+        now = self.clock()
+        if not self.interval:
+            return now
+        if self.next_time is None:
+            self.next_time = now
+        start_time = self.next_time
+        self.next_time += self.interval * count
+        return start_time
+
+    def wait(self, count: int = 1) -> float:
+        start_time = self.reserve(count)
+        delay = start_time - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        return start_time
+
+    async def async_wait(self, count: int = 1) -> float:
+        start_time = self.reserve(count)
+        delay = start_time - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return start_time
@@ -0,0 +1,105 @@
+##
+##
+
+import logging
+import csv
+import json
+import os
+import threading
+import time
+import lib.config as config
+from lib.exec_step import LatencyStats, LatencyHistogram
+
+SERIES_FIELDS = ["time", "label", "elapsed", "ops", "ops_per_second", "errors", "error_rate", "inflight", "p99"]
+
+
+class IntervalReporter(object):
+
+    def __init__(self, label: str, stats: list[LatencyStats], interval: int = None, series_file: str = None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.label = label
+        self.stats = stats
+        self.interval = config.interval_seconds if interval is None else interval
+        self.series_file = config.series_file if series_file is None else series_file
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.begin_time = None
+        self.last_time = None
+        self.last_counts = None
+        self.last_errors = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if not self.interval:
+            return
+        self.begin_time = self.last_time = time.perf_counter()
+        self.last_counts, self.last_errors = self.snapshot()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def snapshot(self) -> tuple[list, int]:
+        histogram = LatencyHistogram()
+        for stats in self.stats:
+            histogram.counts = [a + b for a, b in zip(histogram.counts, list(stats.histogram.counts))]
+        return histogram.counts, sum(stats.errors for stats in self.stats)
+
+    def sample(self) -> dict:
+        now = time.perf_counter()
+        counts, errors = self.snapshot()
+        histogram = LatencyHistogram()
+        histogram.counts = counts
+        interval = histogram.interval(self.last_counts)
+        row = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "label": self.label,
+            "elapsed": round(now - self.begin_time, 3),
+            "ops": interval.total,
+            "ops_per_second": round(interval.total / max(now - self.last_time, 1e-9), 1),
+            "errors": errors - self.last_errors,
+            "error_rate": round((errors - self.last_errors) / interval.total, 6) if interval.total else 0.0,
+            "inflight": sum(stats.pending for stats in self.stats),
+            "p99": interval.value_at(99) / 1000,
+        }
+        self.last_time, self.last_counts, self.last_errors = now, counts, errors
+        return row
+
+    def report(self):
+        row = self.sample()
+        self.logger.info(f"{row['label']}: {row['ops_per_second']:.0f} ops/sec errors {row['error_rate']:.2%} "
+                         f"in-flight {row['inflight']} p99 {row['p99']:.3f} ms")
+        if self.series_file:
+            self.write_series(row)
+
+    def write_series(self, row: dict):
+        try:
+            if self.series_file.endswith('.csv'):
+                header = not os.path.exists(self.series_file) or os.path.getsize(self.series_file) == 0
+                with open(self.series_file, 'a', newline='') as series:
+                    writer = csv.DictWriter(series, fieldnames=SERIES_FIELDS)
+                    if header:
+                        writer.writeheader()
+                    writer.writerow(row)
+            else:
+                with open(self.series_file, 'a') as series:
+                    series.write(json.dumps(row) + '\n')
+        except OSError as err:
+            self.logger.error(f"can not write time series file {self.series_file}: {err}")
+            self.series_file = None
@@ -152,6 +152,7 @@ class Collection(object):
     record_count = attr.ib(validator=attr.validators.optional(io(int)), default=None)
     key_format = attr.ib(validator=attr.validators.optional(io(str)), default=None)
     indexes = attr.ib(validator=attr.validators.optional(io(list)), default=None)
+    queries = attr.ib(validator=attr.validators.optional(io(list)), default=None)
 
     @classmethod
     def from_config(cls, json_data: dict):
@@ -179,7 +180,8 @@ class Collection(object):
             [],
             json_data.get("record_count"),
             json_data.get("key_format"),
-            [ProcessVariables.resolve_variables(i) for i in json_data.get("indexes")]
+            [ProcessVariables.resolve_variables(i) for i in json_data.get("indexes")],
+            [CollectionQuery.from_config(q) for q in json_data.get("queries", [])]
             )
 
     def add_index_name(self, name: str):
@@ -215,6 +217,27 @@ class CollectionDoc(object):
         return self.__dict__
 
 
+@attr.s
+class CollectionQuery(object):
+    name = attr.ib(validator=io(str))
+    statement = attr.ib(validator=io(str))
+    parameters = attr.ib(validator=io(dict))
+    weight = attr.ib(validator=io((int, float)))
+
+    @classmethod
+    def from_config(cls, json_data: dict):
+        return cls(
+            json_data.get("name"),
+            json_data.get("statement"),
+            json_data.get("parameters", {}),
+            json_data.get("weight", 1)
+            )
+
+    @property
+    def as_dict(self):
+        return self.__dict__
+
+
 @attr.s
 class Rule(object):
     name = attr.ib(validator=io(str))
@@ -0,0 +1,146 @@
+##
+##
+
+import re
+from typing import Union
+from jinja2 import Template
+from jinja2.environment import Environment
+from jinja2.meta import find_undeclared_variables
+
+token_expression = re.compile(r"{{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\(([^)]*)\))?\s*)?}}")
+jinja_syntax = re.compile(r"{{|{%|{#")
+
+
+class TokenValues(dict):
+
+    def __missing__(self, key):
+        return ''
+
+
+class Node(object):
+    tokens = frozenset()
+
+
+class Literal(Node):
+
+    def __init__(self, value):
+        self.value = value
+
+    def render(self, values: dict):
+        return self.value
+
+
+class Slot(Node):
+
+    def __init__(self, name: str):
+        self.name = name
+        self.tokens = frozenset([name])
+
+    def render(self, values: dict):
+        return str(values[self.name])
+
+
+class Value(Slot):
+
+    def render(self, values: dict):
+        return values[self.name]
+
+
+class Text(Node):
+
+    def __init__(self, fmt: str, names: list):
+        self.fmt = fmt
+        self.names = names
+        self.tokens = frozenset(names)
+
+    def render(self, values: dict):
+        return self.fmt.format(*[values[name] for name in self.names])
+
+
+class JinjaText(Node):
+
+    def __init__(self, text: str):
+        env = Environment()
+        self.tokens = frozenset(find_undeclared_variables(env.parse(text)))
+        self.template = Template(text)
+
+    def render(self, values: dict):
+        return self.template.render(values)
+
+
+class ListNode(Node):
+
+    def __init__(self, items: list):
+        self.items = items
+        self.tokens = frozenset().union(*[i.tokens for i in items])
+
+    def render(self, values: dict):
+        return [i.render(values) for i in self.items]
+
+
+class DictNode(Node):
+
+    def __init__(self, items: list):
+        self.items = items
+        self.tokens = frozenset().union(*[k.tokens | v.tokens for k, v in items])
+
+    def render(self, values: dict):
+        return {k.render(values): v.render(values) for k, v in self.items}
+
+
+def token_key(match: re.Match) -> str:
+    name, filter_name, args = match.groups()
+    if not filter_name:
+        return name
+    args = ','.join(a.strip() for a in (args or '').split(',') if a.strip())
+    return f"{name}|{filter_name}({args})"
+
+
+def compile_text(text: str, filters: frozenset = frozenset(), typed: bool = False) -> Node:
+    if not jinja_syntax.search(text):
+        return Literal(text)
+
+    names = []
+    fmt = []
+    position = 0
+    for match in token_expression.finditer(text):
+        if match.group(2) and match.group(2) not in filters:
+            return JinjaText(text)
+        fmt.append(text[position:match.start()].replace('{', '{{').replace('}', '}}'))
+        fmt.append('{}')
+        names.append(token_key(match))
+        position = match.end()
+    remainder = text[position:]
+    fmt.append(remainder.replace('{', '{{').replace('}', '}}'))
+
+    if jinja_syntax.search(token_expression.sub('', text)):
+        return JinjaText(text)
+    if len(names) == 1 and len(fmt) == 3 and fmt[0] == '' and fmt[2] == '':
+        return Value(names[0]) if typed else Slot(names[0])
+    return Text(''.join(fmt), names)
+
+
+def compile_node(block: Union[dict, list, str, int, float, bool, None], filters: frozenset = frozenset(), typed: bool = False) -> Node:
+    if isinstance(block, dict):
+        return DictNode([(compile_text(k, filters), compile_node(v, filters, typed)) for k, v in block.items()])
+    elif isinstance(block, list):
+        return ListNode([compile_node(v, filters, typed) for v in block])
+    elif isinstance(block, str):
+        return compile_text(block, filters, typed)
+    else:
+        return Literal(block)
+
+
+class DocTemplate(object):
+
+    def __init__(self, block: dict, filters: frozenset = frozenset(), typed: bool = False):
+        self.root = compile_node(block, filters, typed)
+
+    @property
+    def tokens(self):
+        return self.root.tokens
+
+    def render(self, values: dict):
+        if not isinstance(values, TokenValues):
+            values = TokenValues(values)
+        return self.root.render(values)
@@ -0,0 +1,417 @@
+##
+##
+
+import logging
+import asyncio
+import random
+import time
+import concurrent.futures
+from typing import Union
+from jinja2 import Template
+import lib.config as config
+import lib.randomize as rand
+from couchbase.exceptions import CouchbaseException
+from lib.connect import CBConnectBatch, CBConnectAsync, connections
+from lib.distribution import distributions
+from lib.exceptions import ParameterError, TestRunError
+from lib.exec_step import LatencyStats, operation_stats
+from lib.keyformat import KeyStyle, KeyFormat
+from lib.ratelimit import RateLimiter
+from lib.reporter import IntervalReporter
+from lib.schema import Schema, Bucket, Scope, Collection
+from lib.template import Slot, compile_text
+
+KV_OPERATIONS = ("read", "update", "insert", "delete")
+SAMPLE_SIZE = 1000
+DRAW_ATTEMPTS = 8
+PROBE_WINDOW = 16
+RESIZE_FRACTION = 16
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(','):
+        try:
+            name, weight = item.split('=')
+            weights[name.strip()] = float(weight)
+        except ValueError:
+            raise ParameterError(f"operation mix should be in the form read=N,update=N,...: {mix}")
+    unknown = set(weights) - set(KV_OPERATIONS)
+    if unknown:
+        raise ParameterError(f"unknown operation in mix: {', '.join(sorted(unknown))}")
+    if sum(weights.values()) <= 0:
+        raise ParameterError(f"operation mix has no weight: {mix}")
+    return weights
+
+
+class CollectionKeys(object):
+
+    def __init__(self, bucket: Bucket, scope: Scope, collection: Collection):
+        schema_list = collection.schema if type(collection.schema) == list else [collection.schema]
+        self.keyspace = (bucket.name, scope.name, collection.name)
+        self.schema = schema_list[0]
+        self.record_count = sum(s.record_count if s.override_count else config.count for s in schema_list)
+        self.key_format = KeyStyle[collection.key_format.upper()] if collection.key_format else KeyStyle.DEFAULT
+        self.key_prefix = bucket.name if collection.name == "_default" else collection.name
+
+    def key(self, n: int, document: dict = None) -> str:
+        return KeyFormat.key_format(self.key_format, document or {}, self.key_prefix, n, self.schema.id_key)
+
+    def sample(self) -> list[int]:
+        return random.sample(range(1, self.record_count + 1), min(SAMPLE_SIZE, self.record_count))
+
+
+class Workload(object):
+    keyspace = ()
+    label = "workload"
+
+    def __init__(self, names: list):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.stats = {name: LatencyStats() for name in names}
+        self.rows = {name: 0 for name in names}
+        self.missing = {name: 0 for name in names}
+
+    def prepare(self):
+        pass
+
+    async def prepare_async(self):
+        pass
+
+    def operation_window(self):
+        duration = config.run_duration or (0 if config.operation_count else 60)
+        end_time = time.perf_counter() + duration if duration else None
+        n = 0
+        while (not config.operation_count or n < config.operation_count) and (not end_time or time.perf_counter() < end_time):
+            yield self.choose()
+            n += 1
+
+    def status(self, name: str, result) -> Union[bool, None]:
+        return result is not None
+
+    def call(self, db: CBConnectBatch, operation: tuple, start_time: float) -> tuple[str, Union[bool, None], int, float]:
+        try:
+            result = self.execute(db, *operation)
+            status = self.status(operation[0], result)
+        except CouchbaseException as err:
+            self.logger.debug(f"{operation[0]}: {type(err).__name__}: {err}")
+            result, status = None, False
+        return operation[0], status, result if type(result) == int else 0, time.perf_counter() - start_time
+
+    async def call_async(self, db: CBConnectAsync, operation: tuple, start_time: float) -> tuple[str, Union[bool, None], int, float]:
+        try:
+            result = await self.execute_async(db, *operation)
+            status = self.status(operation[0], result)
+        except CouchbaseException as err:
+            self.logger.debug(f"{operation[0]}: {type(err).__name__}: {err}")
+            result, status = None, False
+        return operation[0], status, result if type(result) == int else 0, time.perf_counter() - start_time
+
+    def record(self, name: str, status: Union[bool, None], rows: int, latency: float):
+        self.stats[name].add(latency)
+        self.stats[name].pending -= 1
+        self.rows[name] += rows
+        if status is None:
+            self.missing[name] += 1
+        elif not status:
+            self.stats[name].errors += 1
+
+    def run(self):
+        with IntervalReporter(self.label, list(self.stats.values())):
+            if config.sync_mode:
+                self.run_sync()
+            else:
+                asyncio.run(self.run_async())
+        for name, stats in self.stats.items():
+            stats.stop()
+            operation_stats(name).merge(stats)
+
+    def run_sync(self):
+        concurrency = config.run_threads or config.batch_size
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        limiter = RateLimiter(config.ops_rate)
+        tasks = set()
+
+        try:
+            db = connections.get(CBConnectBatch, *self.keyspace)
+        except Exception as err:
+            raise TestRunError(f"can not connect to Couchbase: {err}")
+
+        self.prepare()
+        for stats in self.stats.values():
+            stats.start()
+        for operation in self.operation_window():
+            while len(tasks) >= concurrency:
+                done, tasks = concurrent.futures.wait(tasks, return_when=concurrent.futures.FIRST_COMPLETED)
+                for task in done:
+                    self.record(*task.result())
+            start_time = limiter.wait()
+            tasks.add(executor.submit(self.call, db, operation, start_time))
+            self.stats[operation[0]].pending += 1
+        for task in concurrent.futures.as_completed(tasks):
+            self.record(*task.result())
+        executor.shutdown()
+
+    async def run_async(self):
+        concurrency = config.run_threads or config.batch_size * 10
+        limiter = RateLimiter(config.ops_rate)
+        tasks = set()
+
+        try:
+            db = await connections.get_async(CBConnectAsync, *self.keyspace)
+        except Exception as err:
+            raise TestRunError(f"can not connect to Couchbase: {err}")
+
+        await self.prepare_async()
+        for stats in self.stats.values():
+            stats.start()
+        for operation in self.operation_window():
+            while len(tasks) >= concurrency:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self.record(*task.result())
+            start_time = await limiter.async_wait()
+            tasks.add(asyncio.ensure_future(self.call_async(db, operation, start_time)))
+            self.stats[operation[0]].pending += 1
+        for task in asyncio.as_completed(tasks):
+            self.record(*await task)
+        await connections.close_async()
+
+    def report(self):
+        for name, stats in self.stats.items():
+            if stats.count:
+                self.logger.info(f"{name} failed {stats.errors}: {stats.summary()}")
+
+
+class KVWorkload(Workload):
+
+    def __init__(self, bucket: Bucket, scope: Scope, collection: Collection):
+        super().__init__(list(KV_OPERATIONS))
+        self.keys = CollectionKeys(bucket, scope, collection)
+        self.keyspace = self.keys.keyspace
+        self.label = collection.name
+        self.schema = self.keys.schema
+        self.record_count = self.keys.record_count
+        self.key_format = self.keys.key_format
+        self.id_field = collection.idkey
+
+        if self.key_format == KeyStyle.UUID:
+            raise ParameterError("KV workload can not address UUID style keys")
+        if config.key_distribution not in distributions:
+            raise ParameterError(f"unknown key distribution {config.key_distribution}")
+
+        weights = parse_mix(config.kv_mix)
+        self.operations = list(weights)
+        self.weights = list(weights.values())
+        self.deleted = set()
+        self.last = self.record_count
+        self.distribution = distributions[config.key_distribution](self.last)
+        rand.prepare_template(self.schema.doc)
+
+    def resize(self):
+        self.distribution = distributions[config.key_distribution](self.last)
+
+    def document(self, n: int) -> dict:
+        rand.set_record(n)
+        document = rand.process_template()
+        document[self.id_field] = n
+        return document
+
+    def key(self, n: int) -> str:
+        return self.keys.key(n, self.document(n) if self.key_format == KeyStyle.TYPE else None)
+
+    def resume(self, last: int):
+        if last > self.last:
+            self.logger.info(f"Collection has records up to {last} from a previous run, inserting from record {last + 1}")
+            self.last = last
+            self.resize()
+
+    def probe(self, db: CBConnectBatch, n: int) -> int:
+        return max([m for m in range(n, n + PROBE_WINDOW) if db.cb_get(self.key(m)) is not None], default=0)
+
+    async def probe_async(self, db: CBConnectAsync, n: int) -> int:
+        found = await asyncio.gather(*[db.cb_get(self.key(m)) for m in range(n, n + PROBE_WINDOW)])
+        return max([m for m, document in zip(range(n, n + PROBE_WINDOW), found) if document is not None], default=0)
+
+    def prepare(self):
+        db = connections.get(CBConnectBatch, *self.keyspace)
+        last, low, step = self.record_count, self.record_count, 1
+        found = self.probe(db, low + step)
+        while found:
+            last, low, step = max(last, found), low + step, step * 2
+            found = self.probe(db, low + step)
+        high = low + step
+        while high - low > 1:
+            mid = (low + high) // 2
+            found = self.probe(db, mid)
+            if found:
+                last, low = max(last, found), mid
+            else:
+                high = mid
+        self.resume(last)
+
+    async def prepare_async(self):
+        db = await connections.get_async(CBConnectAsync, *self.keyspace)
+        last, low, step = self.record_count, self.record_count, 1
+        found = await self.probe_async(db, low + step)
+        while found:
+            last, low, step = max(last, found), low + step, step * 2
+            found = await self.probe_async(db, low + step)
+        high = low + step
+        while high - low > 1:
+            mid = (low + high) // 2
+            found = await self.probe_async(db, mid)
+            if found:
+                last, low = max(last, found), mid
+            else:
+                high = mid
+        self.resume(last)
+
+    def choose(self) -> tuple[str, str, dict]:
+        op = random.choices(self.operations, self.weights)[0]
+        if op == "insert":
+            self.last += 1
+            n = self.last
+            if self.last - self.distribution.n >= max(1, self.distribution.n // RESIZE_FRACTION):
+                self.resize()
+        else:
+            for _ in range(DRAW_ATTEMPTS):
+                n = self.distribution.index(self.last - 1) + 1
+                if n not in self.deleted:
+                    break
+            if op == "delete":
+                self.deleted.add(n)
+        document = self.document(n) if op in ("update", "insert") or self.key_format == KeyStyle.TYPE else None
+        key = self.keys.key(n, document)
+        return op, key, document if op in ("update", "insert") else None
+
+    def execute(self, db: CBConnectBatch, op: str, key: str, document: dict):
+        if op == "read":
+            return db.cb_get(key)
+        elif op == "update":
+            return db.cb_upsert(key, document)
+        elif op == "insert":
+            return db.cb_insert(key, document)
+        else:
+            return db.cb_remove(key)
+
+    async def execute_async(self, db: CBConnectAsync, op: str, key: str, document: dict):
+        if op == "read":
+            return await db.cb_get(key)
+        elif op == "update":
+            return await db.cb_upsert(key, document)
+        elif op == "insert":
+            return await db.cb_insert(key, document)
+        else:
+            return await db.cb_remove(key)
+
+    def run(self):
+        self.logger.info(f"Running KV workload {config.kv_mix} on {'.'.join(self.keyspace)} with {self.record_count} records")
+        super().run()
+
+    def status(self, name: str, result) -> Union[bool, None]:
+        if result is None and name in ("read", "delete"):
+            return None
+        return result is not None
+
+    def report(self):
+        for name, stats in self.stats.items():
+            if stats.count:
+                self.logger.info(f"{name} not found {self.missing[name]} failed {stats.errors}: {stats.summary()}")
+
+
+class QueryWorkload(Workload):
+    label = "query"
+
+    def __init__(self, schema: Schema):
+        self.statements = {}
+        self.weights = {}
+        self.parameters = {}
+        self.sampled = {}
+        self.samples = {}
+
+        for bucket in schema.buckets:
+            for scope in bucket.scopes:
+                for collection in scope.collections:
+                    keys = CollectionKeys(bucket, scope, collection)
+                    fields = self.token_fields(keys.schema.doc)
+                    if scope.name == "_default" and collection.name == "_default":
+                        keyspace = bucket.name
+                    else:
+                        keyspace = f"{bucket.name}.{scope.name}.{collection.name}"
+                    for query in collection.queries or []:
+                        if query.name in self.statements:
+                            raise ParameterError(f"duplicate query name {query.name}")
+                        self.statements[query.name] = Template(query.statement).render(keyspace=keyspace)
+                        self.weights[query.name] = query.weight
+                        self.parameters[query.name] = rand.ParameterTemplate(query.parameters)
+                        sampled = {p: fields[t] for p, t in self.parameter_tokens(query.parameters).items() if t in fields}
+                        if sampled and keys.key_format in (KeyStyle.DEFAULT, KeyStyle.COLLECTION):
+                            self.sampled[query.name] = (keys, sampled)
+
+        if not self.statements:
+            raise ParameterError(f"schema {schema.name} does not define any queries")
+
+        super().__init__(list(self.statements))
+        self.names = list(self.statements)
+
+    @staticmethod
+    def token_fields(document: dict) -> dict:
+        return {t: f for f, t in QueryWorkload.parameter_tokens(document).items()}
+
+    @staticmethod
+    def parameter_tokens(block: dict) -> dict:
+        tokens = {}
+        for name, value in block.items():
+            node = compile_text(value, frozenset(distributions)) if isinstance(value, str) else None
+            if isinstance(node, Slot):
+                tokens[name] = node.name
+        return tokens
+
+    def add_samples(self, name: str, fields: dict, documents: list):
+        self.samples[name] = [{p: d[f] for p, f in fields.items()} for d in documents if d and all(f in d for f in fields.values())]
+        if not self.samples[name]:
+            self.logger.warning(f"No loaded documents to sample parameters for query {name}")
+
+    def prepare(self):
+        documents = {}
+        for name, (keys, fields) in self.sampled.items():
+            if keys.keyspace not in documents:
+                try:
+                    db = connections.get(CBConnectBatch, *keys.keyspace)
+                    documents[keys.keyspace] = [db.cb_get(keys.key(n)) for n in keys.sample()]
+                except CouchbaseException as err:
+                    raise TestRunError(f"can not sample documents from {'.'.join(keys.keyspace)}: {err}")
+            self.add_samples(name, fields, documents[keys.keyspace])
+
+    async def prepare_async(self):
+        documents = {}
+        for name, (keys, fields) in self.sampled.items():
+            if keys.keyspace not in documents:
+                try:
+                    db = await connections.get_async(CBConnectAsync, *keys.keyspace)
+                    documents[keys.keyspace] = await asyncio.gather(*[db.cb_get(keys.key(n)) for n in keys.sample()])
+                except CouchbaseException as err:
+                    raise TestRunError(f"can not sample documents from {'.'.join(keys.keyspace)}: {err}")
+            self.add_samples(name, fields, documents[keys.keyspace])
+
+    def choose(self) -> tuple[str, dict]:
+        name = random.choices(self.names, [self.weights[n] for n in self.names])[0]
+        parameters = self.parameters[name].render()
+        if self.samples.get(name):
+            parameters.update(random.choice(self.samples[name]))
+        return name, parameters
+
+    def execute(self, db: CBConnectBatch, name: str, parameters: dict):
+        return db.cb_query_rows(self.statements[name], parameters)
+
+    async def execute_async(self, db: CBConnectAsync, name: str, parameters: dict):
+        return await db.cb_query_rows(self.statements[name], parameters)
+
+    def run(self):
+        self.logger.info(f"Running query workload with {len(self.statements)} statement(s)")
+        super().run()
+
+    def report(self):
+        for name, stats in self.stats.items():
+            if stats.count:
+                self.logger.info(f"{name} rows {self.rows[name]} ({self.rows[name] / stats.count:.1f}/query) failed {stats.errors}: {stats.summary()}")
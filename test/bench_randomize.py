@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+from jinja2 import Template
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import lib.config as config
+import lib.randomize as rand
+from lib.schema import ProcessSchema
+from lib.template import DocTemplate
+
+warnings.filterwarnings("ignore")
+
+
+class Params(object):
+
+    def __init__(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--schema', action='store', help="Schema name", default="default")
+        parser.add_argument('--count', action='store', help="Document count", type=int, default=20000)
+        parser.add_argument('--batch', action='store', help="Batch size", type=int, default=1000)
+        self.args = parser.parse_args()
+
+    @property
+    def parameters(self):
+        return self.args
+
+
+def schema_documents(name: str):
+    inventory = ProcessSchema(parent + '/schema/schema.json').inventory()
+    schema = inventory.get(name)
+    if not schema:
+        print(f"Schema {name} not found")
+        sys.exit(1)
+    for bucket in schema.buckets:
+        for scope in bucket.scopes:
+            for collection in scope.collections:
+                for doc in collection.schema:
+                    yield collection.name, doc.doc
+
+
+def report(label: str, count: int, start: float, end: float):
+    elapsed = end - start
+    print(f"  {label:<24} {count / elapsed:>12,.0f} docs/sec")
+    return count / elapsed
+
+
+def bench_render(block: dict, count: int):
+    compiled = DocTemplate(block)
+    values = {tag: f"value_{tag}" for tag in compiled.tokens}
+    legacy = Template(json.dumps(block))
+
+    start = time.perf_counter()
+    for n in range(count):
+        json.loads(legacy.render(**values).encode('ascii'))
+    end = time.perf_counter()
+    before = report("render jinja+json", count, start, end)
+
+    start = time.perf_counter()
+    for n in range(count):
+        compiled.render(values)
+    end = time.perf_counter()
+    after = report("render compiled", count, start, end)
+    print(f"  {'speedup':<24} {after / before:>12.1f}x")
+
+
+def bench_generate(block: dict, count: int):
+    rand.prepare_template(block)
+    start = time.perf_counter()
+    for n in range(count):
+        rand.process_template()
+    end = time.perf_counter()
+    before = report("process_template", count, start, end)
+
+    start = time.perf_counter()
+    for n in range(0, count, options.batch):
+        rand.generate_batch(min(options.batch, count - n))
+    end = time.perf_counter()
+    after = report("generate_batch", count, start, end)
+    print(f"  {'speedup':<24} {after / before:>12.1f}x")
+
+
+p = Params()
+options = p.parameters
+
+rand.rand_init()
+
+for collection_name, document in schema_documents(options.schema):
+    print(f"Collection {collection_name}:")
+    bench_render(document, options.count)
+    bench_generate(document, options.count)
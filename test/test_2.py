@@ -1,12 +1,45 @@
 #!/usr/bin/env python3
 
+import os
+import logging
+import re
+import json
+import csv
+import numpy
 import warnings
+import time
+import concurrent.futures
+import asyncio
+import pytest
+from jinja2 import Template
 from lib.randomize import (rand_init, rand_gender, past_date, dob_date, rand_first_name, rand_last_name, month_value, credit_card, social_security_number, four_digits, zip_code,
                            account_number, dollar_amount, numeric_sequence, hash_code, address_line, rand_city, rand_state, nick_name, email_address, user_name, phone_number,
                            boolean_value, date_code, year_value, past_date_slash, past_date_hyphen, past_date_text, dob_slash, dob_hyphen, dob_text, day_value, rand_franchise,
-                           rand_corporation)
+                           rand_corporation, prepare_template, process_template, resolve_tokens, parse_filter,
+                           generate_batch, batch_table, set_image_pool)
+from lib.template import DocTemplate
+from lib.generator import GeneratorPool, read_shard
+from lib.datastore import DataStore, write_store
+from lib.distribution import get_distribution
+from lib.exec_step import DBWrite, LatencyStats, timed_call, operation_stats, collect_stats, reset_stats, write_stats
+from lib.main import MainLoop, load_range
+from lib.keyformat import KeyStyle
+from lib.ratelimit import RateLimiter
+from lib.reporter import IntervalReporter
+from lib.checkpoint import Checkpoint
+from lib.connect import ConnectionRegistry, CBConnectBatch, CBConnectAsync
+from couchbase.exceptions import TemporaryFailException, DocumentExistsException, CouchbaseException
+from lib.schema import ProcessSchema
+from lib.workload import KVWorkload, QueryWorkload, parse_mix
+import lib.workload
+import lib.randomize
+import lib.main
+import lib.exec_step
+import lib.config
 
 warnings.filterwarnings("ignore")
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
 
 
 def test_random_1():
@@ -47,3 +80,827 @@ def test_random_1():
     print("DOB Date 1 : " + dob_slash(_dob_date))
     print("DOB Date 2 : " + dob_hyphen(_dob_date))
     print("DOB Date 3 : " + dob_text(_dob_date))
+
+
+def schema_templates():
+    with open(parent + '/schema/schema.json', 'r') as schema_file:
+        schema_json = json.load(schema_file)
+    for entry in schema_json.get("inventory"):
+        for name in entry:
+            for bucket in entry[name].get("buckets", []):
+                for scope in bucket.get("scopes"):
+                    for collection in scope.get("collections"):
+                        schema = collection.get("schema")
+                        if type(schema) == dict:
+                            yield schema
+                        elif type(schema) == list:
+                            for item in schema:
+                                yield item.get("doc")
+
+
+def test_template_1():
+    rand_init()
+    for block in schema_templates():
+        compiled = DocTemplate(block)
+        values = {tag: f"value_{tag}" for tag in compiled.tokens}
+        legacy = json.loads(Template(json.dumps(block)).render(**values))
+        assert compiled.render(values) == legacy
+        prepare_template(block)
+        document = process_template()
+        assert document.keys() == block.keys()
+
+
+def test_template_2():
+    plan = [name for name, func in resolve_tokens({'rand_email', 'rand_day'})]
+    assert plan.index('_gender') < plan.index('rand_first') < plan.index('rand_email')
+    assert plan.index('rand_last') < plan.index('rand_email')
+    assert plan.index('rand_month') < plan.index('rand_day')
+    assert 'rand_ssn' not in plan
+    assert 'rand_image' not in plan
+
+
+def value_shape(value) -> str:
+    return re.sub(r'[A-Z]', 'A', re.sub(r'[a-z]', 'a', re.sub(r'[0-9]', '9', str(value))))
+
+
+def test_batch_1(monkeypatch):
+    rand_init()
+    fixed = {'rand_four', 'rand_account', 'rand_id', 'rand_zip_code', 'rand_bool', 'rand_year', 'rand_date_1', 'rand_date_2', 'rand_dob_1',
+             'rand_dob_2', 'rand_password'}
+    block = {tag: f"{{{{ {tag} }}}}" for tag in batch_table if not tag.startswith('_')}
+    prepare_template(block)
+    documents = generate_batch(500)
+    assert len(documents) == 500
+    scalar = [process_template() for _ in range(500)]
+    for tag in fixed:
+        assert set(value_shape(d[tag]) for d in documents) == set(value_shape(d[tag]) for d in scalar)
+    for document in documents:
+        assert 1 <= int(document['rand_month']) <= 12
+        assert 1 <= int(document['rand_day']) <= 31
+        assert float(document['rand_dollar']) >= 0.01
+        assert re.match(r'^[0-9]{3}-[2-9][0-9]{2}-[0-9]{4}$', document['rand_phone'])
+        assert 'X' not in document['rand_credit_card']
+        assert re.match(r'^[0-9A-Za-z]{16}$', document['rand_hash'])
+    monkeypatch.setattr(lib.randomize, "data_struct", {"card_masks": ["4XXX XXXX XXXX XXXX", "34XX XXXXXX XXXXX"]})
+    cards = lib.randomize.batch_credit_card(100, {})
+    assert all(re.match(r'^(4[0-9]{3} [0-9]{4} [0-9]{4} [0-9]{4}|34[0-9]{2} [0-9]{6} [0-9]{5})$', c) for c in cards)
+
+
+def test_generator_1():
+    block = {"id": "{{ incr_value }}", "first": "{{ rand_first }}", "zip": "{{ rand_zip_code }}", "email": "{{ rand_email }}", "ssn": "{{ rand_ssn }}"}
+    keys = []
+    emails = set()
+    ssns = set()
+    for n, documents in GeneratorPool(3, block_size=50).blocks(block, 1, 2300):
+        for key, document in zip(range(n, n + len(documents)), documents):
+            assert document['id'] == str(key)
+            keys.append(key)
+            emails.add(document['email'])
+            ssns.add(document['ssn'])
+    assert sorted(keys) == list(range(1, 2301))
+    assert len(emails) == 2300
+    assert len(ssns) == 2300
+
+
+def test_generator_2(tmp_path):
+    block = {"id": "{{ incr_value }}", "ssn": "{{ rand_ssn }}"}
+    shards = GeneratorPool(2, block_size=64).write_shards(block, 1, 501, str(tmp_path / "test"), compress=True)
+    assert [(s['start'], s['count']) for s in shards] == [(1, 251), (252, 250)]
+    ids = []
+    for shard in shards:
+        assert shard['file'].endswith('.ndjson.gz')
+        for documents in read_shard(str(tmp_path / shard['file']), 100):
+            ids.extend(int(d['id']) for d in documents)
+    assert ids == list(range(1, 502))
+
+
+def test_generator_3():
+    block = {"id": "{{ incr_value }}", "city": "{{ rand_city | zipf(0.99) }}"}
+    cities = {}
+    for n, documents in GeneratorPool(2, block_size=50, start_method="spawn").blocks(block, 1, 1000):
+        for document in documents:
+            cities[document['city']] = cities.get(document['city'], 0) + 1
+    assert sum(cities.values()) == 1000
+    assert max(cities.values()) > 1000 // len(cities) * 5
+
+
+def test_unique_1(monkeypatch):
+    rand_init()
+    prepare_template({"ssn": "{{ rand_ssn }}", "nickname": "{{ rand_nickname }}", "email": "{{ rand_email }}", "username": "{{ rand_username }}"})
+    documents = generate_batch(20000) + [process_template() for _ in range(20000)]
+    for field in ("ssn", "nickname", "email", "username"):
+        assert len(set(d[field] for d in documents)) == len(documents)
+    assert all(re.match(r'^[0-9]{3}-[0-9]{2}-[0-9]{4}$', d['ssn']) for d in documents)
+    monkeypatch.setattr(lib.randomize, "issued_struct", {"username": {}, "email": {}, "nickname": {}})
+    monkeypatch.setattr(lib.randomize, "unique_plain", False)
+    resumed = generate_batch(20000, start=40001)
+    for field in ("nickname", "email", "username"):
+        assert len(set(d[field] for d in documents + resumed)) == len(documents) + len(resumed)
+
+
+def test_image_1(tmp_path):
+    rand_init()
+    set_image_pool(4, 32, 16, "PNG", str(tmp_path))
+    prepare_template({"image": "{{ rand_image }}"})
+    images = set(d['image'] for d in generate_batch(100))
+    assert 0 < len(images) <= 4
+    assert len(list(tmp_path.iterdir())) == 1
+    set_image_pool(4, 32, 16, "PNG", str(tmp_path))
+    assert process_template()['image'] in images
+
+
+def test_datastore_1(tmp_path, monkeypatch, caplog):
+    data = {"names": {"male": ["Aaron", "Zoë"], "female": []}, "cities": ["Springfield", "Shelbyville", ""]}
+    store_file = str(tmp_path / "data.bin")
+    write_store(store_file, data)
+    store = DataStore(store_file)
+    assert list(store.get("names").get("male")) == ["Aaron", "Zoë"]
+    assert len(store.get("names").get("female")) == 0
+    assert store.get("cities").take([2, 0]) == ["", "Springfield"]
+    assert store.get("missing") is None
+    data_file = tmp_path / "data.json"
+    data_file.write_text(json.dumps({"cities": ["Ogdenville"]}))
+    os.utime(store_file, (1, 1))
+    monkeypatch.setattr(lib.randomize, "data_struct", {})
+    monkeypatch.setattr(lib.randomize, "data_file_name", str(data_file))
+    monkeypatch.setattr(lib.randomize, "store_file_name", store_file)
+    with caplog.at_level(logging.WARNING):
+        lib.randomize.load_data()
+    assert lib.randomize.data_struct == {"cities": ["Ogdenville"]}
+    assert "is newer than" in caplog.text
+    os.utime(store_file)
+    monkeypatch.setattr(lib.randomize, "data_struct", {})
+    lib.randomize.load_data()
+    assert list(lib.randomize.data_struct.get("cities")) == ["Springfield", "Shelbyville", ""]
+
+
+def test_distribution_1():
+    generator = numpy.random.default_rng(1)
+    zipf = get_distribution("zipf", 100, (1.0,))
+    expected = 1.0 / numpy.arange(1, 101)
+    expected = expected / expected.sum()
+    observed = numpy.bincount(zipf.ranks(200000, generator), minlength=100) / 200000
+    assert numpy.abs(observed - expected).max() < 0.01
+    hotspot = get_distribution("hotspot", 1000, (0.1, 0.9))
+    assert abs((hotspot.ranks(100000, generator) < 100).mean() - 0.9) < 0.01
+    assert sorted(set(zipf.indices(100000, generator))) == list(range(100))
+    exponential = get_distribution("exponential", 10 ** 7, (0.95, 0.1))
+    assert abs((exponential.ranks(100000, generator) < 10 ** 6).mean() - 0.95) < 0.01
+    assert get_distribution("zipf", 10 ** 9, ()).ranks(100000, generator).max() > 1 << 18
+    latest = get_distribution("latest", 1000, ())
+    assert latest.index(500) in range(1000)
+    rand_init()
+    prepare_template({"city": "{{ rand_city | zipf(0.99) }}", "zip": "{{ rand_zip_code | hotspot(0.01, 0.9) }}"})
+    documents = generate_batch(1000) + [process_template() for _ in range(1000)]
+    assert all(re.match(r'^[0-9]{5}$', d['zip']) for d in documents)
+    assert len(set(d['city'] for d in documents)) < 1000
+    for tag in ("rand_city|zipf(1,2,3,4)", "rand_city|zipf(0)", "rand_zip_code|hotspot(-1)", "rand_city|exponential(0.9,2)"):
+        with pytest.raises(SystemExit):
+            parse_filter(tag)
+    assert parse_filter("rand_city|hotspot(0.2,0.8)") == ("rand_city", "hotspot", (0.2, 0.8))
+
+
+def test_pipeline_1():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    stats = LatencyStats()
+    loop = MainLoop()
+    tasks = set()
+    completed = 0
+    for n in range(200):
+        completed += loop.task_drain(tasks, stats, 15)
+        assert len(tasks) <= 15
+        tasks.add(executor.submit(timed_call, lambda x: time.sleep(0.001) or {x: x % 4 > 0}, n))
+    completed += loop.task_drain(tasks, stats)
+    stats.stop()
+    assert completed == 150
+    assert stats.count == 200
+    assert stats.percentile(50) >= 1.0
+    assert "ops/sec" in stats.summary()
+
+
+class MemoryConnect(object):
+    documents = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def connect(self, *args):
+        return self
+
+    def bucket(self, name):
+        pass
+
+    def scope(self, name):
+        pass
+
+    def collection(self, name):
+        pass
+
+    def cb_upsert(self, key, document):
+        self.documents[key] = document
+        return True
+
+    def cb_get(self, key):
+        return self.documents.get(key)
+
+    def cb_query_rows(self, statement, parameters):
+        assert "FROM sample_app.profiles.user_data WHERE" in statement
+        return len([d for d in self.documents.values() if d.get("user_id") == parameters.get("user_id")]) if "user_id" in parameters else 2
+
+    def cb_insert(self, key, document):
+        return None if key in self.documents else self.cb_upsert(key, document)
+
+    def cb_remove(self, key):
+        return self.documents.pop(key, None)
+
+    @staticmethod
+    def construct_key(key):
+        return f"test:{key}" if str(key).isdigit() else key
+
+    def cb_upsert_multi(self, documents):
+        self.documents.update(documents)
+        return {key: True for key in documents}
+
+    def cb_insert_multi(self, documents):
+        return {key: self.cb_insert(key, document) for key, document in documents.items()}
+
+
+class MemoryConnectAsync(MemoryConnect):
+
+    async def connect(self, *args):
+        return self
+
+    async def open_bucket(self, name):
+        return None
+
+    def select(self, *args):
+        return self
+
+    async def cb_upsert(self, key, document):
+        await asyncio.sleep(0)
+        self.documents[key] = document
+        return True
+
+    async def cb_query_rows(self, statement, parameters):
+        return MemoryConnect.cb_query_rows(self, statement, parameters)
+
+    async def cb_get(self, key):
+        return self.documents.get(key)
+
+    async def cb_insert(self, key, document):
+        return None if key in self.documents else MemoryConnect.cb_upsert(self, key, document)
+
+    async def cb_remove(self, key):
+        return self.documents.pop(key, None)
+
+    async def cb_upsert_multi(self, documents):
+        await asyncio.sleep(0)
+        self.documents.update(documents)
+        return {key: True for key in documents}
+
+    async def cb_insert_multi(self, documents):
+        await asyncio.sleep(0)
+        return {key: None if key in self.documents else self.documents.setdefault(key, document) is document for key, document in documents.items()}
+
+    async def close(self):
+        pass
+
+
+class FlakyCollection(object):
+
+    def __init__(self):
+        self.documents = {"test:2": {}}
+        self.failed = set()
+
+    def write(self, key, document, insert):
+        if key not in self.failed:
+            self.failed.add(key)
+            raise TemporaryFailException()
+        if key == "test:9":
+            raise CouchbaseException()
+        if insert and key in self.documents:
+            raise DocumentExistsException()
+        self.documents[key] = document
+
+    def multi(self, documents, insert):
+        result = lambda: None
+        result.results, result.exceptions = {}, {}
+        for key, document in documents.items():
+            try:
+                self.write(key, document, insert)
+                result.results[key] = True
+            except Exception as err:
+                result.exceptions[key] = err
+        return result
+
+    def upsert_multi(self, documents):
+        return self.multi(documents, False)
+
+    def insert_multi(self, documents):
+        return self.multi(documents, True)
+
+    async def upsert(self, key, document):
+        return self.write(key, document, False)
+
+    async def insert(self, key, document):
+        return self.write(key, document, True)
+
+
+class MemoryCollection(FlakyCollection):
+
+    def __init__(self):
+        self.documents = MemoryConnect.documents
+
+    def write(self, key, document, insert):
+        if insert and key in self.documents:
+            raise DocumentExistsException()
+        self.documents[key] = document
+
+
+class CollectionConnect(MemoryConnect):
+    retry_multi = CBConnectBatch.retry_multi
+    cb_upsert_multi = CBConnectBatch.cb_upsert_multi
+    cb_insert_multi = CBConnectBatch.cb_insert_multi
+
+    def collection(self, name):
+        self.logger = logging.getLogger("test")
+        self._collection = MemoryCollection()
+
+
+class CollectionConnectAsync(MemoryConnectAsync):
+    retry_multi = CBConnectAsync.retry_multi
+    cb_upsert_multi = CBConnectAsync.cb_upsert_multi
+    cb_insert_multi = CBConnectAsync.cb_insert_multi
+
+    def select(self, *args):
+        self.logger = logging.getLogger("test")
+        self._collection = MemoryCollection()
+        return self
+
+
+def test_engine_1(monkeypatch):
+    for sync_mode, safe_mode, connect_classes in ((False, False, (MemoryConnect, MemoryConnectAsync)),
+                                                  (False, True, (MemoryConnect, MemoryConnectAsync)),
+                                                  (True, True, (MemoryConnect, MemoryConnectAsync)),
+                                                  (False, True, (CollectionConnect, CollectionConnectAsync)),
+                                                  (True, True, (CollectionConnect, CollectionConnectAsync))):
+        monkeypatch.setattr(lib.main, "CBConnectBatch", connect_classes[0])
+        monkeypatch.setattr(lib.main, "CBConnectAsync", connect_classes[1])
+        monkeypatch.setattr(lib.config, "sync_mode", sync_mode)
+        monkeypatch.setattr(lib.config, "safe_mode", safe_mode)
+        MemoryConnect.documents = {"test:3": {}}
+        blocks = iter([[(f"test:{n}", {"n": n}) for n in range(b, b + 300)] for b in range(1, 3000, 300)])
+        stats = LatencyStats()
+        inserted, submitted = MainLoop().write("test", "_default", "_default", "record_id", blocks, stats)
+        assert submitted == 3000
+        assert inserted == (2999 if safe_mode else 3000)
+        assert MemoryConnect.documents["test:3"] == ({} if safe_mode else {"n": 3, "record_id": 3})
+        assert stats.count == inserted
+        assert stats.errors == 0
+        assert stats.pending == 0
+        assert MemoryConnect.documents["test:42"] == {"n": 42, "record_id": 42}
+
+
+def test_connections_1(monkeypatch):
+    monkeypatch.setattr(lib.main, "CBConnectBatch", MemoryConnect)
+    monkeypatch.setattr(lib.main, "CBConnectAsync", MemoryConnectAsync)
+    monkeypatch.setattr(lib.config, "connection_count", 3)
+    for sync_mode in (False, True):
+        monkeypatch.setattr(lib.config, "sync_mode", sync_mode)
+        reset_stats()
+        blocks = iter([[(f"test:{n}", {"n": n}) for n in range(b, b + 300)] for b in range(1, 3000, 300)])
+        inserted, submitted = MainLoop().write("test", "_default", "_default", "record_id", blocks, LatencyStats())
+        assert inserted == submitted == 3000
+        results = collect_stats()
+        counts = [results[f"conn.{n}"].count for n in range(3)]
+        assert sum(counts) == 3000 and max(counts) - min(counts) <= lib.config.write_batch
+    reset_stats()
+    registry = ConnectionRegistry()
+    monkeypatch.setattr(registry, "cluster", lambda connect_class, slot=0: slot)
+    assert [registry.get(MemoryConnect, slot=n)._cluster for n in range(3)] == [0, 1, 2]
+
+
+def test_retry_1():
+    documents = {f"test:{n}": {"n": n} for n in range(1, 10)}
+    expected = {key: key != "test:9" for key in documents}
+    for connect_class in (CBConnectBatch, CBConnectAsync):
+        db = connect_class.__new__(connect_class)
+        db.logger = logging.getLogger("test")
+        for method, status in ((db.cb_upsert_multi, expected), (db.cb_insert_multi, dict(expected, **{"test:2": None}))):
+            db._collection = FlakyCollection()
+            result = method(documents)
+            assert (asyncio.run(result) if asyncio.iscoroutine(result) else result) == status
+
+
+class CountConnect(MemoryConnect):
+
+    def collection_count(self):
+        return len(self.documents)
+
+
+class RejectingConnectAsync(MemoryConnectAsync):
+
+    async def cb_upsert_multi(self, documents):
+        status = await MemoryConnectAsync.cb_upsert_multi(self, {k: v for k, v in documents.items() if "fail" not in v})
+        return {key: status.get(key, False) for key in documents}
+
+
+def test_input_1(monkeypatch, caplog):
+    monkeypatch.setattr(lib.main, "CBConnect", CountConnect)
+    monkeypatch.setattr(lib.main, "CBConnectAsync", RejectingConnectAsync)
+    monkeypatch.setattr(MainLoop, "prep_bucket", staticmethod(lambda *args: None))
+    monkeypatch.setattr(lib.config, "key_field", "doc_id")
+    MemoryConnect.documents = {}
+    monkeypatch.setattr(lib.config, "insert_data", '{"doc_id": "a"} {"doc_id": "b"}')
+    with caplog.at_level(logging.INFO):
+        MainLoop().input_load()
+    assert "inserted 2 additional record(s)" in caplog.text
+    monkeypatch.setattr(lib.config, "insert_data", '{"doc_id": "c"} {"doc_id": "d", "fail": true}')
+    with caplog.at_level(logging.INFO), pytest.raises(SystemExit):
+        MainLoop().input_load()
+    assert "had 2 documents - inserted 1 additional record(s)" in caplog.text
+    assert "1 of 2 record(s) failed to write" in caplog.text
+
+
+def test_engine_2(monkeypatch):
+    monkeypatch.setattr(lib.config, "write_batch", 7)
+    MemoryConnect.documents = {"test:2": {}}
+    db_op = DBWrite(MemoryConnect())
+    assert [len(b) for b in MainLoop.write_batches(list(range(20)))] == [7, 7, 6]
+    result = db_op.execute_many([(1, {"a": 1}), ("test:2", {"a": 2}), (3, {"a": 3})], no_squash=True)
+    assert result == {"test:1": True, "test:3": True}
+    assert MemoryConnect.documents["test:3"] == {"a": 3, "record_id": 3}
+    assert MemoryConnect.documents["test:2"] == {}
+    assert db_op.execute_many([("test:2", {"a": 2}), ("test:4", {"a": 4})]) == {"test:2": True, "test:4": True}
+    assert MemoryConnect.documents["test:2"] == {"a": 2, "record_id": 2}
+
+
+def test_load_1(monkeypatch):
+    monkeypatch.setattr(lib.main, "CBConnectAsync", MemoryConnectAsync)
+    block = {"id": "{{ incr_value }}", "name": "{{ rand_first }}"}
+    key_info = (KeyStyle.DEFAULT, "test", "record_id", 100)
+    extra = [(lib.config.settings(), ("test", "_default", "_default", "record_id"), key_info, logging.WARNING)] * 3
+    items = list(GeneratorPool(3, block_size=64).run(load_range, block, 1, 1000, extra))
+    results = [r for r in items if r[0] != "complete"]
+    checkpoint = Checkpoint(None, "test")
+    for item in [r for r in items if r[0] == "complete"]:
+        checkpoint.complete(item[1], item[2])
+    assert checkpoint.mark == 1000
+    assert sum(r[0] for r in results) == 1000
+    assert sum(r[1] for r in results) == 1000
+    assert sum(r[2].count for r in results) == 1000
+    assert sum(r[3]["upsert"].count for r in results) == 1000
+    rand_init()
+    prepare_template(block)
+    keys = [k for ranges in GeneratorPool.split_range(1, 1000, 3)
+            for b in MainLoop.key_blocks(MainLoop.generate_blocks(ranges[0], ranges[1], 64), *key_info) for k, d in b]
+    assert keys == [f"test:{n}" for n in range(101, 1101)]
+
+
+def spawn_load_range(*args):
+    lib.main.CBConnectAsync = MemoryConnectAsync
+    load_range(*args)
+
+
+def test_load_2():
+    block = {"id": "{{ incr_value }}", "name": "{{ rand_first }}"}
+    key_info = (KeyStyle.DEFAULT, "test", "record_id", 0)
+    settings = dict(lib.config.settings(), connection_count=2, write_batch=7)
+    extra = [(settings, ("test", "_default", "_default", "record_id"), key_info, logging.WARNING)] * 2
+    items = list(GeneratorPool(2, block_size=64, start_method="spawn").run(spawn_load_range, block, 1, 500, extra))
+    results = [r for r in items if r[0] != "complete"]
+    assert len(results) == 2
+    assert sum(r[0] for r in results) == 500
+    assert sum(r[3]["conn.0"].count + r[3]["conn.1"].count for r in results) == 500
+    assert sum(item[2] for item in items if item[0] == "complete") == 500
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_ratelimit_1():
+    for rate, count in ((20000, 1), (250000, 10)):
+        clock = FakeClock()
+        limiter = RateLimiter(rate, clock, clock.sleep)
+        starts = [limiter.wait(count) for _ in range(100)]
+        assert starts == pytest.approx([100.0 + n * count / rate for n in range(100)])
+        assert clock.now == starts[-1]
+        clock.now += 1.0
+        late = clock.now
+        assert limiter.wait(count) == pytest.approx(100.0 + 100 * count / rate)
+        assert clock.now == late
+    clock = FakeClock()
+    limiter = RateLimiter(1000, clock, clock.sleep)
+
+    async def paced():
+        return await asyncio.gather(*[limiter.async_wait() for _ in range(50)])
+
+    starts = asyncio.run(paced())
+    assert starts == pytest.approx([100.0 + n / 1000 for n in range(50)])
+    clock = FakeClock()
+    assert RateLimiter(0, clock, clock.sleep).wait(100) == 100.0 and clock.now == 100.0
+
+
+def test_stats_1(tmp_path):
+    reset_stats()
+    values = numpy.random.default_rng(1).exponential(0.002, 20000)
+
+    def record(part):
+        for value in part:
+            operation_stats("upsert").add(value)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(record, numpy.array_split(values, 4)))
+    stats = collect_stats()["upsert"]
+    assert stats.count == 20000
+    for p in (50, 90, 99, 99.9):
+        assert abs(stats.percentile(p) - numpy.percentile(values, p) * 1000) < numpy.percentile(values, p) * 1000 * 0.01 + 0.002
+    assert stats.percentile(100) == int(values.max() * 1000000) / 1000
+    stats_file = str(tmp_path / "stats.json")
+    write_stats(stats_file, "load")
+    with open(stats_file) as result:
+        data = json.load(result)
+    assert data["command"] == "load"
+    assert data["operations"]["upsert"]["count"] == 20000
+    assert set(data["operations"]["upsert"]) >= {"p50", "p90", "p99", "p99.9", "max", "errors", "ops_per_second"}
+    reset_stats()
+
+
+def test_reporter_1(tmp_path):
+    stats = LatencyStats()
+    series_file = str(tmp_path / "series.csv")
+    with IntervalReporter("test", [stats], 0.1, series_file):
+        stats.add(0.002, 99)
+        stats.add(0.050)
+        stats.errors = 5
+        stats.pending = 3
+        time.sleep(0.15)
+    with open(series_file) as series:
+        rows = list(csv.DictReader(series))
+    assert len(rows) == 1
+    assert rows[0]["label"] == "test" and rows[0]["ops"] == "100" and rows[0]["inflight"] == "3"
+    assert float(rows[0]["error_rate"]) == 0.05
+    assert 1.99 < float(rows[0]["p99"]) < 2.02
+    reporter = IntervalReporter("test", [stats], 1, str(tmp_path / "series.json"))
+    reporter.start()
+    stats.add(0.010, 10)
+    reporter.report()
+    reporter.stop()
+    with open(tmp_path / "series.json") as series:
+        row = json.loads(series.readline())
+    assert row["ops"] == 10 and row["errors"] == 0 and 9.9 < row["p99"] < 10.1
+
+
+class FailingConnectAsync(MemoryConnectAsync):
+
+    async def cb_upsert_multi(self, documents):
+        result = await MemoryConnectAsync.cb_upsert_multi(self, {k: v for k, v in documents.items() if k != "cbperf:777"})
+        return dict(result, **{k: False for k in documents if k == "cbperf:777"})
+
+
+def test_checkpoint_1(monkeypatch, tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(checkpoint_file, "test")
+    for first in (11, 31, 1):
+        checkpoint.complete(first, 10)
+    assert checkpoint.mark == 20
+    checkpoint.save()
+    assert Checkpoint(checkpoint_file, "test", resume=True).start == 20
+    assert Checkpoint(checkpoint_file, "test").start == 0
+    assert Checkpoint(checkpoint_file, "test", resume=True).start == 0
+    monkeypatch.setattr(lib.main, "CBConnectAsync", FailingConnectAsync)
+    monkeypatch.setattr(lib.config, "schema", ProcessSchema(lib.config.schema_file).inventory().get("default"))
+    monkeypatch.setattr(lib.config, "checkpoint_file", checkpoint_file)
+    monkeypatch.setattr(lib.config, "count", 1000)
+    MemoryConnect.documents = {}
+    MainLoop().process(*MainLoop.select_collection())
+    assert len(MemoryConnect.documents) == 999
+    assert Checkpoint(checkpoint_file, "cbperf._default._default.0", resume=True).start == 770
+    monkeypatch.setattr(lib.main, "CBConnectAsync", MemoryConnectAsync)
+    monkeypatch.setattr(lib.config, "skip_init", True)
+    MemoryConnect.documents = {}
+    MainLoop().process(*MainLoop.select_collection())
+    assert set(MemoryConnect.documents) == {f"cbperf:{n}" for n in range(771, 1001)}
+    assert Checkpoint(checkpoint_file, "cbperf._default._default.0", resume=True).start == 1000
+
+
+def test_parallel_1(monkeypatch):
+    monkeypatch.setattr(lib.main, "CBConnectAsync", MemoryConnectAsync)
+    monkeypatch.setattr(lib.config, "schema", ProcessSchema(lib.config.schema_file).inventory().get("profile_demo"))
+    monkeypatch.setattr(lib.config, "count", 100)
+    monkeypatch.setattr(lib.config, "image_pool_size", 2)
+    monkeypatch.setattr(lib.main, "LOAD_START_METHOD", "fork")
+    monkeypatch.setattr(lib.config, "load_parallel", 4)
+    monkeypatch.setattr(lib.config, "ops_rate", 400)
+    monkeypatch.setattr(MainLoop, "pre_process", lambda *args: None)
+    rules = []
+    monkeypatch.setattr(MainLoop, "run_link_rule", lambda self, *args: rules.append(args))
+    collections = [(b, s, c) for b in lib.config.schema.buckets for s in b.scopes for c in s.collections]
+    keyspaces = [MainLoop.keyspace_name(*c) for c in collections]
+    rule = lib.config.schema.rules[0]
+    assert MainLoop.rule_keyspaces(rule, keyspaces) == {"sample_app.profiles.user_data", "sample_app.profiles.user_images"}
+    rule.type = "sql"
+    assert MainLoop.rule_keyspaces(rule, keyspaces) == {"sample_app.profiles.user_data", "sample_app.profiles.user_images"}
+    rule.type = "link"
+    reset_stats()
+    MainLoop().schema_load()
+    expected = sum(d.record_count if d.override_count else 100 for b, s, c in collections for d in (c.schema if type(c.schema) == list else [c.schema]))
+    assert collect_stats()["load"].count == expected
+    assert collect_stats()["load"].ops_per_second < 400
+    assert len(rules) == 1
+    reset_stats()
+
+
+class IndexManager(object):
+    calls = []
+
+    def __init__(self, keyspace):
+        self.keyspace = keyspace
+
+    def create_bucket(self, name, quota):
+        self.keyspace = name
+
+    def create_scope(self, name):
+        self.keyspace += f".{name}"
+
+    def create_collection(self, name):
+        self.keyspace += f".{name}"
+
+    def index_name(self, fields):
+        return f"{fields[0]}_idx"
+
+    def cb_create_primary_index(self, replica=0, deferred=False):
+        IndexManager.calls.append(("primary", self.keyspace, deferred))
+
+    def cb_create_index(self, fields, replica=0, deferred=False):
+        IndexManager.calls.append(("index", self.keyspace, deferred))
+        return self.index_name(fields)
+
+    def cb_build_deferred_indexes(self):
+        IndexManager.calls.append(("build", self.keyspace))
+
+    def cb_watch_indexes(self, names, primary=False):
+        IndexManager.calls.append(("watch", self.keyspace, tuple(names), primary))
+
+
+def test_index_1(monkeypatch):
+    monkeypatch.setattr(lib.main.connections, "get", lambda cls, *keyspace: IndexManager(".".join(keyspace)))
+    monkeypatch.setattr(lib.config, "defer_index", True)
+    schema = ProcessSchema(lib.config.schema_file).inventory().get("profile_demo")
+    collections = [(b, s, c) for b in schema.buckets for s in b.scopes for c in s.collections]
+    indexed = [c for c in collections if c[2].primary_index or c[2].indexes]
+    reset_stats()
+    loop = MainLoop()
+    for bucket, scope, collection in collections:
+        loop.pre_process(bucket, scope, collection)
+    assert IndexManager.calls and all(call[2] for call in IndexManager.calls)
+    IndexManager.calls.clear()
+    loop.build_indexes(collections)
+    builds = [call for call in IndexManager.calls if call[0] == "build"]
+    assert len(builds) == len(indexed)
+    assert IndexManager.calls.index(builds[-1]) < min(i for i, call in enumerate(IndexManager.calls) if call[0] == "watch")
+    assert "index_build" in lib.exec_step.timings
+    reset_stats()
+    assert not lib.exec_step.timings
+
+
+class CountingConnect(MemoryConnect):
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingConnect.created += 1
+
+    def bucket(self, name):
+        self._bucket = name
+
+    def scope(self, name):
+        self._scope = name
+
+
+class CountingConnectAsync(MemoryConnectAsync):
+    opened = []
+    closed = 0
+
+    async def open_bucket(self, name):
+        CountingConnectAsync.opened.append(name)
+        return name
+
+    def select(self, scope, collection):
+        self._scope, self._collection = scope, collection
+        return self
+
+    async def close(self):
+        CountingConnectAsync.closed += 1
+
+
+def test_registry_1():
+    registry = ConnectionRegistry()
+    handles = [registry.get(CountingConnect, "test", "_default", c) for c in ("a", "b")]
+    assert handles[0] is not handles[1] and handles[0]._bucket == handles[1]._bucket == "test"
+    assert handles[0]._scope == "_default"
+
+    async def run():
+        first = await registry.get_async(CountingConnectAsync, "test", "s1", "c1")
+        second = await registry.get_async(CountingConnectAsync, "test", "s2", "c2")
+        await registry.close_async()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert (first._scope, first._collection, second._scope, second._collection) == ("s1", "c1", "s2", "c2")
+    assert CountingConnect.created == 1 and CountingConnectAsync.opened == ["test"] and CountingConnectAsync.closed == 1
+    assert not registry.async_clusters
+    registry.close()
+    assert not registry.sessions
+
+
+def test_calibrate_1(monkeypatch, capsys):
+    monkeypatch.setattr(lib.main, "CBConnectAsync", CountingConnectAsync)
+    monkeypatch.setattr(CountingConnectAsync, "opened", [])
+    monkeypatch.setattr(CountingConnectAsync, "closed", 0)
+    calls = []
+    monkeypatch.setattr(MainLoop, "pre_process", lambda *args: calls.append("pre_process"))
+    monkeypatch.setattr(MainLoop, "build_indexes", lambda self, collections: calls.append("build_indexes"))
+    monkeypatch.setattr(lib.config, "schema", ProcessSchema(lib.config.schema_file).inventory().get("default"))
+    monkeypatch.setattr(lib.config, "skip_init", True)
+    monkeypatch.setattr(lib.config, "defer_index", True)
+    monkeypatch.setattr(lib.config, "ramp_step_time", 0.2)
+    monkeypatch.setattr(lib.config, "run_threads", 1)
+    monkeypatch.setattr(lib.config, "max_threads", 4)
+    MemoryConnect.documents = {}
+    MainLoop().calibrate()
+    output = capsys.readouterr().out
+    assert re.search(r"Recommended concurrency: [124] in-flight batches of [0-9]+ documents$", output.strip())
+    measured = sum(s.count for name, s in collect_stats().items() if name.startswith("calibrate."))
+    assert len(MemoryConnect.documents) > measured
+    assert CountingConnectAsync.opened == ["cbperf"] and CountingConnectAsync.closed == 1
+    assert calls == ["build_indexes"]
+    steps = []
+    for concurrency, rate in ((1, 100), (2, 190), (4, 200), (8, 150)):
+        stats = LatencyStats()
+        stats.add(0.001, rate)
+        stats.end_time = stats.begin_time + 1
+        steps.append((concurrency, stats))
+    assert MainLoop.recommend(steps) == 2
+
+
+def test_kv_1(monkeypatch):
+    monkeypatch.setattr(lib.workload, "CBConnectBatch", MemoryConnect)
+    monkeypatch.setattr(lib.workload, "CBConnectAsync", MemoryConnectAsync)
+    monkeypatch.setattr(lib.config, "count", 200)
+    monkeypatch.setattr(lib.config, "operation_count", 2000)
+    monkeypatch.setattr(lib.config, "kv_mix", "read=70,update=20,insert=5,delete=5")
+    monkeypatch.setattr(lib.config, "key_distribution", "zipf")
+    monkeypatch.setattr(lib.config, "schema", ProcessSchema(lib.config.schema_file).inventory().get("default"))
+    assert parse_mix("read=1, update=3") == {"read": 1.0, "update": 3.0}
+    MemoryConnect.documents = {f"cbperf:{n}": {"record_id": n} for n in range(1, 201)}
+    last = 200
+    for sync_mode in (False, True, False):
+        monkeypatch.setattr(lib.config, "sync_mode", sync_mode)
+        rand_init()
+        workload = KVWorkload(*MainLoop.select_collection())
+        workload.run()
+        assert sum(s.count for s in workload.stats.values()) == 2000
+        assert 1200 < workload.stats["read"].count < 1600
+        assert sum(s.errors for s in workload.stats.values()) == 0
+        assert workload.last == last + workload.stats["insert"].count
+        assert workload.distribution.n > last
+        assert all(re.match(r'^cbperf:[0-9]+$', k) for k in MemoryConnect.documents)
+        last = workload.last
+    MemoryConnect.documents = {f"cbperf:{n}": {"record_id": n} for n in range(1, 101)}
+    workload = KVWorkload(*MainLoop.select_collection())
+    workload.run()
+    assert workload.missing["read"] > 0 and workload.stats["read"].errors == 0
+
+
+def test_query_1(monkeypatch):
+    monkeypatch.setattr(lib.workload, "CBConnectBatch", MemoryConnect)
+    monkeypatch.setattr(lib.workload, "CBConnectAsync", MemoryConnectAsync)
+    monkeypatch.setattr(lib.config, "operation_count", 1000)
+    schema = ProcessSchema(lib.config.schema_file).inventory().get("profile_demo")
+    rand_init()
+    lib.randomize.set_record(5)
+    parameters = lib.randomize.ParameterTemplate({"id": "{{ incr_value }}", "label": "n{{ incr_value }}", "flag": "{{ rand_bool }}"}).render()
+    assert parameters["id"] == 5 and parameters["label"] == "n5" and type(parameters["flag"]) == bool
+    for sync_mode in (False, True):
+        monkeypatch.setattr(lib.config, "sync_mode", sync_mode)
+        MemoryConnect.documents = {f"user_data:{n}": {"user_id": f"user{n}", "nickname": f"nick{n}"} for n in range(1, 101)}
+        rand_init()
+        workload = QueryWorkload(schema)
+        assert set(workload.statements) == {"by_user_id", "by_nickname"}
+        assert set(workload.sampled) == {"by_user_id", "by_nickname"}
+        workload.run()
+        assert len(workload.samples["by_user_id"]) == 100
+        assert workload.rows["by_user_id"] == workload.stats["by_user_id"].count
+        assert sum(s.count for s in workload.stats.values()) == 1000
+        assert 350 < workload.stats["by_nickname"].count < 650
+        assert workload.rows["by_nickname"] == 2 * workload.stats["by_nickname"].count
+        assert workload.stats["by_user_id"].errors == 0